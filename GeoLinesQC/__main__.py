@@ -0,0 +1,258 @@
+"""Command line entry point, to run the QC without the QGIS desktop.
+
+Usage, from the directory containing the GeoLinesQC package::
+
+    python -m GeoLinesQC input.gpkg reference.gpkg output.gpkg --buffer 100
+
+QGIS is initialized standalone, like qgis_process does. Set QGIS_PREFIX_PATH
+if QGIS is not installed in the default location.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from .engine import (
+    DEFAULT_BUFFER,
+    DEFAULT_SEGMENT_LENGTH,
+    INDEXES,
+    METHOD_BUFFER,
+    METHODS,
+    parse_distance,
+    parse_distances,
+    search_distance,
+)
+from .profiling import PROFILERS, create_profiler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m GeoLinesQC",
+        description="Checks if the lines of a layer are within a given distance "
+        "of the lines of a reference layer.",
+    )
+    parser.add_argument("input", help="Lines to check (GeoPackage, Shapefile, ...)")
+    parser.add_argument("reference", help="Reference lines, e.g. Geocover or TK500")
+    parser.add_argument(
+        "output", help="Output file, the format is guessed from its extension"
+    )
+    parser.add_argument("--region", help="Polygons the check is restricted to")
+    parser.add_argument(
+        "--buffer",
+        type=parse_distances,
+        default=[DEFAULT_BUFFER],
+        help="Buffer distance [m], or comma separated distances checked in a "
+        f"single pass, e.g. 100,500 (default: {DEFAULT_BUFFER})",
+    )
+    parser.add_argument(
+        "--segment-length",
+        type=float,
+        default=DEFAULT_SEGMENT_LENGTH,
+        help=f"Segment length [m] (default: {DEFAULT_SEGMENT_LENGTH})",
+    )
+    parser.add_argument(
+        "--method",
+        choices=METHODS,
+        default=METHOD_BUFFER,
+        help=f"Proximity test (default: {METHOD_BUFFER})",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=parse_distance,
+        help="Store the distance to the nearest reference line, up to this "
+        "distance [m], in a 'distance' field",
+    )
+    parser.add_argument(
+        "--index",
+        choices=INDEXES,
+        help="Spatial index of the reference (default: the index setting, rtree)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes, only with --method distance (default: 1)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Number of segments written at once",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILERS,
+        help="Profile the run, the profile is saved next to the output: "
+        "cprofile writes a .prof file, sampling a speedscope .speedscope.json file",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        default="INFO",
+        help="Level of the messages printed to stderr, DEBUG lists every "
+        "skipped feature (default: INFO)",
+    )
+    parser.add_argument(
+        "--stats",
+        metavar="REPORT",
+        help="Write the timings of every stage and the counters to this JSON file",
+    )
+    return parser.parse_args(argv)
+
+
+def init_qgis():
+    """
+    Initializes a standalone QGIS application.
+
+    Returns:
+        QgsApplication: The application, to be closed with exitQgis().
+    """
+    from qgis.core import QgsApplication
+
+    prefix_path = os.environ.get("QGIS_PREFIX_PATH")
+    if prefix_path:
+        QgsApplication.setPrefixPath(prefix_path, True)
+
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    return app
+
+
+def load_layer(path, name):
+    from qgis.core import QgsVectorLayer
+
+    layer = QgsVectorLayer(path, name, "ogr")
+    if not layer.isValid():
+        raise OSError(f"Cannot open {path}")
+    return layer
+
+
+class ConsoleFeedback:
+    """Prints the progress of the analysis to stderr, every 10 percent."""
+
+    def __init__(self):
+        self.last_step = -1
+
+    def isCanceled(self):
+        return False
+
+    def setProgress(self, progress):
+        step = int(progress) // 10
+        if step != self.last_step:
+            self.last_step = step
+            print(f"{step * 10}%", file=sys.stderr)
+
+
+def run(args):
+    from .analysis import (
+        DEFAULT_BATCH_SIZE,
+        masked_features,
+        open_output_file,
+        run_analysis,
+    )
+    from .reference import (
+        build_reference_index,
+        check_reference_crs,
+        reference_cache_key,
+        reference_request,
+    )
+    from .stats import RunStats
+    from .utils import RegionMask
+
+    stats = RunStats()
+    buffer_distance = args.buffer[0] if len(args.buffer) == 1 else args.buffer
+    with_distance = args.max_distance is not None
+
+    input_layer = load_layer(args.input, "input")
+    reference_layer = load_layer(args.reference, "reference")
+    check_reference_crs(input_layer.crs(), reference_layer.crs())
+    mask = None
+    if args.region:
+        with stats.stage("clip"):
+            mask = RegionMask.from_layer(
+                load_layer(args.region, "region"), input_layer.crs()
+            )
+
+    with stats.stage("index"):
+        reference_index = build_reference_index(
+            reference_layer,
+            args.method,
+            reference_request(
+                input_layer.extent(),
+                search_distance(buffer_distance, args.max_distance),
+                mask,
+            ),
+            mask,
+            index=args.index,
+            cache_key=reference_cache_key(reference_layer),
+        )
+    sink, fields, output = open_output_file(
+        args.output,
+        input_layer.crs(),
+        os.path.splitext(os.path.basename(args.output))[0],
+        with_distance=with_distance,
+        buffer_distance=buffer_distance,
+    )
+    try:
+        features, segments, intersecting = run_analysis(
+            masked_features(input_layer, mask),
+            reference_index,
+            sink,
+            fields,
+            buffer_distance,
+            args.segment_length,
+            batch_size=args.batch_size or DEFAULT_BATCH_SIZE,
+            workers=args.workers if args.method != METHOD_BUFFER else 1,
+            feature_count=input_layer.featureCount(),
+            feedback=ConsoleFeedback(),
+            max_distance=args.max_distance,
+            stats=stats,
+        )
+    finally:
+        # Deleting the writer or the file layer closes the file
+        del sink, output
+
+    print(
+        f"{features} features, {segments} segments, {intersecting} intersecting: "
+        f"{args.output}"
+    )
+    print(stats.summary(), file=sys.stderr)
+    if args.stats:
+        stats.write_json(args.stats, parameters=vars(args))
+
+
+def run_profiled(args):
+    """Runs the check under a profiler, see --profile."""
+    profiler = create_profiler(args.profile)
+    try:
+        with profiler:
+            run(args)
+    finally:
+        path = profiler.save(os.path.splitext(args.output)[0])
+        print(f"Profile saved to {path}, hottest functions:", file=sys.stderr)
+        for line in profiler.top_functions():
+            print(line, file=sys.stderr)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level, format="%(levelname)s: %(message)s")
+    app = init_qgis()
+    from .utils import ClipError
+
+    try:
+        if args.profile:
+            run_profiled(args)
+        else:
+            run(args)
+    except (ClipError, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        app.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
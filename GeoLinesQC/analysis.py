@@ -0,0 +1,575 @@
+import logging
+import os
+import time
+
+from qgis.core import (
+    Qgis,
+    QgsCoordinateTransformContext,
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsMessageLog,
+    QgsTask,
+    QgsVectorFileWriter,
+    QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QVariant, pyqtSignal
+
+from .engine import (
+    METHOD_BUFFER,
+    METHOD_DISTANCE,
+    check_lines,
+    check_lines_parallel,
+    format_distance,
+    search_distance,
+)
+from .incremental import changed_features
+from .reference import build_reference_index, reference_cache_key, reference_request
+from .stats import RunStats
+from .utils import RateLimiter, coords_to_geometry, geometry_to_parts
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+# Maximum number of progress updates per second, each one repaints the GUI
+DEFAULT_UPDATE_RATE = 10
+
+METHOD_LABELS = {
+    METHOD_BUFFER: "Buffer polygon (GEOS)",
+    METHOD_DISTANCE: "Exact distance",
+}
+
+
+def intersects_fields(buffer_distance):
+    """
+    Returns the names of the intersection result fields.
+
+    Args:
+        buffer_distance (float or list): The buffer distance(s).
+
+    Returns:
+        list: "intersects" for a single buffer distance, otherwise one
+            "intersects_<distance>" name per buffer distance, e.g. "intersects_100"
+            or "intersects_2_5".
+    """
+    if not isinstance(buffer_distance, (list, tuple)):
+        return ["intersects"]
+    return [
+        f"intersects_{format_distance(distance)}".replace(".", "_")
+        for distance in buffer_distance
+    ]
+
+
+def output_fields(with_distance=False, buffer_distance=None):
+    """
+    Returns the fields of the output segments.
+
+    Args:
+        with_distance (bool): Whether to add the "distance" field.
+        buffer_distance (float or list): The buffer distance(s), one
+            intersection result field is added per buffer distance.
+
+    Returns:
+        QgsFields: The "id" (of the checked feature) and intersection result
+            fields, and the distance to the nearest reference line if requested.
+    """
+    fields = QgsFields()
+    fields.append(QgsField("id", QVariant.Int))
+    for name in intersects_fields(buffer_distance):
+        fields.append(QgsField(name, QVariant.Bool))
+    if with_distance:
+        fields.append(QgsField("distance", QVariant.Double))
+    return fields
+
+
+def create_output_layer(crs, layer_name, with_distance=False, buffer_distance=None):
+    """
+    Creates the memory layer receiving the segments and their intersection results.
+
+    Args:
+        crs (QgsCoordinateReferenceSystem): CRS of the checked layer.
+        layer_name (str): Name of the output layer.
+        with_distance (bool): Whether to add the "distance" field.
+        buffer_distance (float or list): The buffer distance(s).
+
+    Returns:
+        QgsVectorLayer: An empty LineString memory layer.
+    """
+    output_layer = QgsVectorLayer(
+        "LineString?crs=" + crs.authid(), layer_name, "memory"
+    )
+    output_layer.dataProvider().addAttributes(
+        output_fields(with_distance, buffer_distance).toList()
+    )
+    output_layer.updateFields()
+    return output_layer
+
+
+def create_output_writer(
+    path, crs, layer_name, with_distance=False, buffer_distance=None
+):
+    """
+    Creates a vector file receiving the segments and their intersection results.
+
+    The format is guessed from the extension of the path, e.g. .gpkg or .shp.
+
+    Args:
+        path (str): Path of the file to create.
+        crs (QgsCoordinateReferenceSystem): CRS of the checked layer.
+        layer_name (str): Name of the layer in the file.
+        with_distance (bool): Whether to add the "distance" field.
+        buffer_distance (float or list): The buffer distance(s).
+
+    Returns:
+        QgsVectorFileWriter: The writer, a feature sink. It must be deleted to
+            close the file.
+
+    Raises:
+        OSError: If the file cannot be created.
+    """
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = QgsVectorFileWriter.driverForExtension(
+        os.path.splitext(path)[1]
+    )
+    options.layerName = layer_name
+    options.fileEncoding = "UTF-8"
+
+    writer = QgsVectorFileWriter.create(
+        path,
+        output_fields(with_distance, buffer_distance),
+        QgsWkbTypes.LineString,
+        crs,
+        QgsCoordinateTransformContext(),
+        options,
+    )
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise OSError(f"Cannot create {path}: {writer.errorMessage()}")
+    return writer
+
+
+def open_output_file(path, crs, layer_name, with_distance=False, buffer_distance=None):
+    """
+    Creates a vector file and opens it to stream the segments into it.
+
+    A GeoPackage is created empty and filled through its OGR data provider,
+    which writes every addFeatures call in its own transaction: the segments
+    written so far are kept if QGIS stops during a run. Other formats, e.g.
+    FlatGeobuf, are written by the file writer.
+
+    The features must be created with the returned fields: those of a
+    GeoPackage layer start with its "fid" column.
+
+    Args:
+        path (str): Path of the file to create.
+        crs (QgsCoordinateReferenceSystem): CRS of the checked layer.
+        layer_name (str): Name of the layer in the file.
+        with_distance (bool): Whether to add the "distance" field.
+        buffer_distance (float or list): The buffer distance(s).
+
+    Returns:
+        tuple: The sink receiving the segments, the fields of its features,
+            and the object owning the sink, which must be deleted to close
+            the file.
+
+    Raises:
+        OSError: If the file cannot be created.
+    """
+    writer = create_output_writer(path, crs, layer_name, with_distance, buffer_distance)
+    if os.path.splitext(path)[1].lower() != ".gpkg":
+        return writer, output_fields(with_distance, buffer_distance), writer
+
+    # Deleting the writer closes the file, which is then opened for appending
+    del writer
+    layer = load_output_file(path, layer_name)
+    return layer.dataProvider(), layer.fields(), layer
+
+
+def load_output_file(path, layer_name):
+    """
+    Opens the layer of an output file.
+
+    Args:
+        path (str): Path of the file.
+        layer_name (str): Name of the layer in the file.
+
+    Returns:
+        QgsVectorLayer: The layer.
+
+    Raises:
+        OSError: If the file cannot be opened.
+    """
+    layer = QgsVectorLayer(f"{path}|layername={layer_name}", layer_name, "ogr")
+    if not layer.isValid():
+        layer = QgsVectorLayer(path, layer_name, "ogr")
+    if not layer.isValid():
+        raise OSError(f"Cannot open {path}")
+    return layer
+
+
+def add_features(sink, features):
+    """
+    Writes features to a sink, failing loudly rather than losing them.
+
+    Args:
+        sink: Anything with an addFeatures method, e.g. a data provider.
+        features (list): The QgsFeatures.
+
+    Raises:
+        OSError: If the sink rejects the features.
+    """
+    result = sink.addFeatures(features)
+    # Data providers also return the added features
+    if isinstance(result, tuple):
+        result = result[0]
+    if not result:
+        error = sink.lastError() if hasattr(sink, "lastError") else ""
+        raise OSError(
+            f"Cannot write {len(features)} segments: {error or 'unknown error'}"
+        )
+
+
+def run_analysis(
+    features,
+    reference_index,
+    sink,
+    fields,
+    buffer_distance,
+    segment_length,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=1,
+    feature_count=0,
+    feedback=None,
+    on_batch=None,
+    max_distance=None,
+    stats=None,
+    update_rate=DEFAULT_UPDATE_RATE,
+):
+    """
+    Segments the input features, checks every segment and writes it to a sink.
+
+    Args:
+        features (iterable): The QgsFeatures to check.
+        reference_index: The reference, see reference.build_reference_index.
+        sink: Anything with an addFeatures method, e.g. a data provider.
+        fields (QgsFields): Fields of the sink, the attributes are set by name.
+        buffer_distance (float or list): The buffer distance, or a list of
+            buffer distances checked in the same pass.
+        segment_length (float): The desired length of each segment.
+        batch_size (int): Number of segments written to the sink at once.
+        workers (int): Number of processes checking the segments. More than
+            one needs an engine ReferenceIndex (exact distance test).
+        feature_count (int): Number of input features, used for progress.
+        feedback (QgsFeedback or QgsTask): Optional, for progress and cancellation.
+        on_batch (callable): Optional, called with the (features, segments,
+            intersecting) counts after a batch is written, and once at the end.
+        max_distance (float): Optional, the distance to the nearest reference
+            line is stored in the "distance" field, up to this distance.
+        stats (RunStats): Optional, receives the load, segmentation, proximity
+            and write timings, and the feature, segment and reference counters.
+        update_rate (float): Maximum number of progress and on_batch updates
+            per second.
+
+    Returns:
+        tuple: The number of features, segments and intersecting segments
+            processed, at the first buffer distance.
+
+    Raises:
+        OSError: If a batch of segments cannot be written.
+    """
+    counts = [0, 0, 0]
+    skipped = 0
+    names = intersects_fields(buffer_distance)
+    progress = RateLimiter(update_rate)
+    partial_counts = RateLimiter(update_rate)
+
+    def lines():
+        nonlocal skipped
+        for feature in features:
+            if feedback is not None and feedback.isCanceled():
+                return
+
+            counts[0] += 1
+            if feedback is not None and feature_count and progress.ready():
+                feedback.setProgress(100.0 * counts[0] / feature_count)
+
+            try:
+                if not feature.hasGeometry():
+                    raise ValueError("No geometry")
+                parts = geometry_to_parts(feature.geometry())
+            except ValueError as e:
+                # Cheap unless the DEBUG level is set, bad geometries can be many
+                logger.debug("Skipping feature %s: %s", feature.id(), e)
+                skipped += 1
+                if stats is not None:
+                    stats.count("skipped")
+                continue
+            yield feature.id(), parts
+
+    # Reading the features is timed apart from checking them
+    input_lines = lines() if stats is None else stats.timed(lines(), "load")
+    reference_index.stats = stats
+
+    if workers > 1:
+        results = check_lines_parallel(
+            input_lines,
+            reference_index,
+            buffer_distance,
+            segment_length,
+            workers,
+            max_distance=max_distance,
+            stats=stats,
+        )
+    else:
+        results = check_lines(
+            input_lines,
+            reference_index,
+            buffer_distance,
+            segment_length,
+            max_distance,
+            stats,
+        )
+
+    batch_size = max(1, batch_size)
+    batch = []
+
+    # Add each segment to the output with its intersection result
+    for fid, coords, intersects, distance in results:
+        start = time.perf_counter()
+        new_feature = QgsFeature(fields)
+        new_feature.setGeometry(coords_to_geometry(coords))
+        new_feature.setAttribute("id", fid)
+        if not isinstance(intersects, tuple):
+            intersects = (intersects,)
+        for name, value in zip(names, intersects):
+            new_feature.setAttribute(name, value)
+        if max_distance is not None:
+            new_feature.setAttribute("distance", distance)
+        batch.append(new_feature)
+        counts[1] += 1
+        counts[2] += intersects[0]
+
+        flush = len(batch) >= batch_size
+        if flush:
+            add_features(sink, batch)
+            batch = []
+        if stats is not None:
+            stats.add_time("write", time.perf_counter() - start)
+
+        if flush:
+            if on_batch is not None and partial_counts.ready():
+                on_batch(*counts)
+            if feedback is not None and feedback.isCanceled():
+                break
+
+    if batch:
+        start = time.perf_counter()
+        add_features(sink, batch)
+        if stats is not None:
+            stats.add_time("write", time.perf_counter() - start)
+    if on_batch is not None:
+        on_batch(*counts)
+    if feedback is not None and feature_count:
+        feedback.setProgress(100.0 * counts[0] / feature_count)
+
+    if skipped:
+        logger.info("Skipped %d features without a line geometry", skipped)
+    if stats is not None:
+        stats.count("features", counts[0])
+        stats.count("intersecting", counts[2])
+    return tuple(counts)
+
+
+def masked_features(source, mask=None):
+    """
+    Iterates over the features of a layer, clipped with an optional region mask.
+
+    Args:
+        source (QgsVectorLayer or QgsFeatureSource): The layer to read.
+        mask (RegionMask): Optional, the region the features are clipped with.
+
+    Returns:
+        iterable: The QgsFeatures.
+    """
+    if mask is None:
+        return source.getFeatures()
+    return mask.features(source.getFeatures(mask.request()))
+
+
+class GeolinesQCTask(QgsTask):
+    """
+    Runs the analysis in the background, filling an output memory layer, or
+    streaming the segments to a file if an output path is given.
+
+    The layers are wrapped in feature sources when the task is created, on the
+    main thread, so that the task never touches the project layers themselves.
+    With a region mask, features are clipped while they are read.
+
+    The geometry hash of every checked feature is recorded. Given the hashes
+    of a previous run, only new and edited features are checked, the segments
+    of edited and deleted features being listed in stale_ids.
+
+    The timings and counters of the run are collected in stats. Given a
+    profiler, see profiling.create_profiler, the run is profiled and the
+    profile saved next to profile_path, its hottest functions being logged.
+    Progress and partial counts are reported at most update_rate times per
+    second.
+    """
+
+    # Number of features, segments and intersecting segments processed so far
+    segmentsWritten = pyqtSignal(int, int, int)
+
+    def __init__(
+        self,
+        description,
+        input_layer,
+        reference_layer,
+        output_layer,
+        buffer_distance,
+        segment_length,
+        method,
+        batch_size=DEFAULT_BATCH_SIZE,
+        workers=1,
+        mask=None,
+        max_distance=None,
+        output_path=None,
+        output_name=None,
+        previous_hashes=None,
+        stats=None,
+        profiler=None,
+        profile_path=None,
+        update_rate=DEFAULT_UPDATE_RATE,
+    ):
+        super().__init__(description, QgsTask.CanCancel)
+        self.input_source = QgsVectorLayerFeatureSource(input_layer)
+        self.feature_count = input_layer.featureCount()
+        self.input_extent = input_layer.extent()
+        self.crs = input_layer.crs()
+        self.reference_source = QgsVectorLayerFeatureSource(reference_layer)
+        self.reference_cache_key = reference_cache_key(reference_layer)
+        self.output_layer = output_layer
+        self.buffer_distance = buffer_distance
+        self.segment_length = segment_length
+        self.method = method
+        self.batch_size = batch_size
+        self.workers = workers
+        self.mask = mask
+        self.max_distance = max_distance
+        self.output_path = output_path
+        self.output_name = output_name
+        self.previous_hashes = previous_hashes or {}
+        self.stats = stats if stats is not None else RunStats()
+        self.profiler = profiler
+        self.profile_path = profile_path
+        self.update_rate = update_rate
+
+        self.hashes = {}
+        self.stale_ids = []
+        self.counts = (0, 0, 0)
+        self.exception = None
+        self.profile_file = None
+
+    def run(self):
+        if self.profiler is None:
+            return self.analyze()
+        try:
+            with self.profiler:
+                return self.analyze()
+        finally:
+            self.save_profile()
+
+    def save_profile(self):
+        """Saves the profile of the run and logs its hottest functions."""
+        try:
+            self.profile_file = self.profiler.save(self.profile_path)
+        except OSError as e:
+            QgsMessageLog.logMessage(
+                f"Cannot save the profile {self.profile_path}: {e}",
+                "GeoLinesQC",
+                level=Qgis.Warning,
+            )
+            return
+        QgsMessageLog.logMessage(
+            f"Profile saved to {self.profile_file}, hottest functions:\n"
+            + "\n".join(self.profiler.top_functions()),
+            "GeoLinesQC",
+            level=Qgis.Info,
+        )
+
+    def analyze(self):
+        """Runs the analysis, in the task's thread, see run."""
+        workers = self.workers
+        if workers > 1 and self.method != METHOD_DISTANCE:
+            QgsMessageLog.logMessage(
+                "Parallel processing needs the exact distance test, running sequentially",
+                "GeoLinesQC",
+                level=Qgis.Warning,
+            )
+            workers = 1
+
+        try:
+            with self.stats.stage("index"):
+                reference_index = build_reference_index(
+                    self.reference_source,
+                    self.method,
+                    reference_request(
+                        self.input_extent,
+                        search_distance(self.buffer_distance, self.max_distance),
+                        self.mask,
+                    ),
+                    self.mask,
+                    cache_key=self.reference_cache_key,
+                )
+            if self.isCanceled():
+                return False
+
+            if self.output_path:
+                # The file is only opened in the task's thread
+                sink, fields, output = open_output_file(
+                    self.output_path,
+                    self.crs,
+                    self.output_name,
+                    self.max_distance is not None,
+                    self.buffer_distance,
+                )
+            else:
+                sink, output = self.output_layer.dataProvider(), None
+                fields = sink.fields()
+
+            try:
+                self.counts = run_analysis(
+                    changed_features(
+                        masked_features(self.input_source, self.mask),
+                        self.previous_hashes,
+                        self.hashes,
+                    ),
+                    reference_index,
+                    sink,
+                    fields,
+                    self.buffer_distance,
+                    self.segment_length,
+                    batch_size=self.batch_size,
+                    workers=workers,
+                    feature_count=self.feature_count,
+                    feedback=self,
+                    on_batch=self.segmentsWritten.emit,
+                    max_distance=self.max_distance,
+                    stats=self.stats,
+                    update_rate=self.update_rate,
+                )
+            finally:
+                # Deleting the writer or the file layer closes the file
+                del sink, output
+        except Exception as e:  # noqa: BLE001
+            # An exception must not escape a task, it is reported once finished
+            self.exception = e
+            return False
+
+        self.stale_ids = [
+            fid
+            for fid, previous_hash in self.previous_hashes.items()
+            if self.hashes.get(fid) != previous_hash
+        ]
+        return not self.isCanceled()
@@ -0,0 +1,1124 @@
+"""Segmentation and proximity checks on plain coordinate arrays.
+
+This module must not import anything from ``qgis``: it is used by the plugin
+through thin adapters, but it can also run headless, e.g. in batch jobs or
+under a profiler. Lines are passed around as lists of parts, each part being
+a ``(n, 2)`` NumPy array of vertex coordinates.
+"""
+
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .stats import RunStats
+
+DEFAULT_BUFFER = 500.0
+DEFAULT_SEGMENT_LENGTH = 200.0
+
+WKB_LINESTRING = 2
+WKB_MULTILINESTRING = 5
+WKB_GEOMETRYCOLLECTION = 7
+
+# Proximity tests: GEOS buffer polygon (QGIS only) or exact minimum distance
+METHOD_BUFFER = "buffer"
+METHOD_DISTANCE = "distance"
+METHODS = (METHOD_BUFFER, METHOD_DISTANCE)
+
+# Number of input lines sent to a worker process at once
+DEFAULT_CHUNK_SIZE = 64
+
+# Reference lines are indexed as pieces of this length, so that the bounding
+# boxes of long lines do not make them a candidate for every segment
+DEFAULT_REFERENCE_CHUNK_LENGTH = 200.0
+
+# Largest number of point to edge distances computed at once
+POINTS_CHUNK_CELLS = 1 << 20
+
+# Consecutive segments tested together before they are tested one by one, few
+# enough for the bounding box of the block to stay close to the line
+PRETEST_BLOCK_SEGMENTS = 16
+
+# Spatial indexes of the reference: packed R-tree or uniform grid
+INDEX_RTREE = "rtree"
+INDEX_GRID = "grid"
+INDEXES = (INDEX_RTREE, INDEX_GRID)
+
+
+def parts_from_wkb(wkb):
+    """
+    Reads the parts of a (Multi)LineString from its WKB representation.
+
+    Args:
+        wkb (bytes): ISO or extended WKB of a LineString, MultiLineString or
+            GeometryCollection of lines. Z and M values are dropped.
+
+    Returns:
+        list: A list of (n, 2) arrays, one per non-empty part.
+
+    Raises:
+        ValueError: If the geometry is not a line geometry, or the WKB is
+            empty or truncated.
+    """
+    parts = []
+    try:
+        _read_wkb(memoryview(wkb), 0, parts)
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Invalid WKB: {e or 'empty'}") from e
+    return parts
+
+
+def _read_wkb(data, offset, parts):
+    endian = "<" if data[offset] == 1 else ">"
+    (code,) = struct.unpack_from(endian + "I", data, offset + 1)
+    offset += 5
+
+    # Extended WKB flags Z/M in the high bits, ISO WKB adds 1000/2000/3000
+    dimensions = 2 + bool(code & 0x80000000) + bool(code & 0x40000000)
+    if code & 0x20000000:
+        # Extended WKB with an embedded SRID
+        offset += 4
+    code &= 0x0FFFFFFF
+    dimensions += {0: 0, 1: 1, 2: 1, 3: 2}[code // 1000]
+    geometry_type = code % 1000
+
+    if geometry_type == WKB_LINESTRING:
+        (count,) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        if offset + 8 * count * dimensions > len(data):
+            raise ValueError("Invalid WKB: truncated LineString")
+        if count:
+            coords = np.frombuffer(
+                data, dtype=endian + "f8", count=count * dimensions, offset=offset
+            ).reshape(count, dimensions)
+            parts.append(coords[:, :2].astype(float))
+        return offset + 8 * count * dimensions
+
+    if geometry_type in (WKB_MULTILINESTRING, WKB_GEOMETRYCOLLECTION):
+        (count,) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        for _ in range(count):
+            offset = _read_wkb(data, offset, parts)
+        return offset
+
+    raise ValueError(f"Unsupported WKB geometry type: {geometry_type}")
+
+
+def segment_single_line(coords, segment_length):
+    """
+    Splits a single line into segments of equal length.
+
+    The cut positions along the line are found on the cumulative vertex
+    distances and interpolated all at once. The last segment holds the
+    remainder and is usually shorter.
+
+    Args:
+        coords (array-like): The (n, 2) vertex coordinates of the line.
+        segment_length (float): The desired length of each segment.
+
+    Returns:
+        list: A list of (n, 2) arrays representing the segments.
+    """
+    coords = np.asarray(coords, dtype=float)[:, :2]
+    if len(coords) < 2 or segment_length <= 0:
+        return [coords]
+
+    steps = np.hypot(*np.diff(coords, axis=0).T)
+    cumulative = np.concatenate(([0.0], np.cumsum(steps)))
+
+    # Cut at every multiple of segment_length strictly inside the line
+    cuts = np.arange(1, math.ceil(cumulative[-1] / segment_length)) * segment_length
+    if not len(cuts):
+        return [coords]
+
+    # Vertex preceding each cut and relative position of the cut on its edge
+    edges = np.searchsorted(cumulative, cuts, side="right") - 1
+    t = (cuts - cumulative[edges]) / steps[edges]
+    cut_points = coords[edges] + t[:, None] * (coords[edges + 1] - coords[edges])
+
+    # Merge the cut points into the vertices, dropping vertices a cut falls on
+    merged = np.insert(coords, edges + 1, cut_points, axis=0)
+    order = np.arange(len(cuts))
+    is_cut = np.zeros(len(merged), dtype=bool)
+    is_cut[edges + 1 + order] = True
+    keep = np.ones(len(merged), dtype=bool)
+    keep[(edges + order)[t == 0]] = False
+    merged = merged[keep]
+
+    bounds = np.concatenate(([0], np.flatnonzero(is_cut[keep]), [len(merged) - 1]))
+    return [merged[start : end + 1] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def segment_line(parts, segment_length):
+    """
+    Splits every part of a (Multi)LineString into segments of equal length.
+
+    Args:
+        parts (list): The parts of the line, as (n, 2) arrays.
+        segment_length (float): The desired length of each segment.
+
+    Returns:
+        list: A list of (n, 2) arrays representing the segments. Parts
+            without vertices are dropped.
+    """
+    segments = []
+    for part in parts:
+        if not len(part):
+            continue
+        segments.extend(segment_single_line(part, segment_length))
+    return segments
+
+
+def segment_distances(a_start, a_end, b_start, b_end):
+    """
+    Computes the pairwise minimum distances between two sets of 2D segments.
+
+    Args:
+        a_start (ndarray): (n, 2) start points of the first set.
+        a_end (ndarray): (n, 2) end points of the first set.
+        b_start (ndarray): (m, 2) start points of the second set.
+        b_end (ndarray): (m, 2) end points of the second set.
+
+    Returns:
+        ndarray: A (n, m) array of distances.
+    """
+    a_start = a_start[:, None, :]
+    a_end = a_end[:, None, :]
+    b_start = b_start[None, :, :]
+    b_end = b_end[None, :, :]
+
+    # Unless they cross, the closest pair involves one of the four endpoints
+    distances = np.minimum(
+        np.minimum(
+            _point_segment_distances(a_start, b_start, b_end),
+            _point_segment_distances(a_end, b_start, b_end),
+        ),
+        np.minimum(
+            _point_segment_distances(b_start, a_start, a_end),
+            _point_segment_distances(b_end, a_start, a_end),
+        ),
+    )
+
+    a_direction = a_end - a_start
+    b_direction = b_end - b_start
+    crossing = (
+        _cross(a_direction, b_start - a_start) * _cross(a_direction, b_end - a_start)
+        < 0
+    ) & (
+        _cross(b_direction, a_start - b_start) * _cross(b_direction, a_end - b_start)
+        < 0
+    )
+    return np.where(crossing, 0.0, distances)
+
+
+def _cross(u, v):
+    return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+
+def _point_segment_distances(points, start, end):
+    direction = end - start
+    squared_length = (direction * direction).sum(axis=-1)
+    offset = points - start
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (offset * direction).sum(axis=-1) / squared_length
+    t = np.clip(np.nan_to_num(t, nan=0.0, posinf=0.0, neginf=0.0), 0.0, 1.0)
+    delta = offset - t[..., None] * direction
+    return np.hypot(delta[..., 0], delta[..., 1])
+
+
+def _edges(coords):
+    """Returns the start and end points of the edges of a line."""
+    if len(coords) == 1:
+        return coords, coords
+    return coords[:-1], coords[1:]
+
+
+def _ranges(starts, stops):
+    """Concatenates the integer ranges [start, stop), without a Python loop."""
+    counts = stops - starts
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(
+        counts.sum()
+    )
+
+
+def _overlaps(bounds, xmin, ymin, xmax, ymax):
+    return (
+        (bounds[:, 0] <= xmax)
+        & (bounds[:, 2] >= xmin)
+        & (bounds[:, 1] <= ymax)
+        & (bounds[:, 3] >= ymin)
+    )
+
+
+class STRtree:
+    """
+    Packed R-tree over bounding boxes, bulk loaded with Sort-Tile-Recursive.
+
+    Every level of the tree is a flat (n, 4) array of ``xmin, ymin, xmax, ymax``
+    bounds, the children of node ``i`` being the nodes ``i * node_capacity`` to
+    ``(i + 1) * node_capacity - 1`` of the level below.
+    """
+
+    def __init__(self, bounds, node_capacity=16):
+        """
+        Args:
+            bounds (array-like): (n, 4) bounding boxes of the items to index.
+            node_capacity (int): Maximum number of children per node.
+        """
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.node_capacity = node_capacity
+        self.items = self._sort_tile_recursive(bounds)
+
+        level = bounds[self.items]
+        self.levels = [level]
+        while len(level) > node_capacity:
+            level = self._pack(level)
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.items)
+
+    def _sort_tile_recursive(self, bounds):
+        count = len(bounds)
+        if count == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        leaves = math.ceil(count / self.node_capacity)
+        slice_size = math.ceil(math.sqrt(leaves)) * self.node_capacity
+        center_x = bounds[:, 0] + bounds[:, 2]
+        center_y = bounds[:, 1] + bounds[:, 3]
+
+        # Sort by x into vertical slices, then by y within each slice
+        order = np.argsort(center_x, kind="stable")
+        slices = np.arange(count) // slice_size
+        return order[np.lexsort((center_y[order], slices))]
+
+    def _pack(self, level):
+        starts = np.arange(0, len(level), self.node_capacity)
+        return np.column_stack(
+            (
+                np.minimum.reduceat(level[:, 0], starts),
+                np.minimum.reduceat(level[:, 1], starts),
+                np.maximum.reduceat(level[:, 2], starts),
+                np.maximum.reduceat(level[:, 3], starts),
+            )
+        )
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Finds the items whose bounding box intersects a rectangle.
+
+        Returns:
+            ndarray: The indices of the matching items.
+        """
+        if not len(self.items):
+            return self.items
+
+        top = self.levels[-1]
+        nodes = np.flatnonzero(_overlaps(top, xmin, ymin, xmax, ymax))
+        for level in reversed(self.levels[:-1]):
+            children = (
+                nodes[:, None] * self.node_capacity + np.arange(self.node_capacity)
+            ).ravel()
+            children = children[children < len(level)]
+            nodes = children[_overlaps(level[children], xmin, ymin, xmax, ymax)]
+
+        return self.items[nodes]
+
+
+class GridIndex:
+    """
+    Uniform grid over bounding boxes, stored as flat arrays.
+
+    Every item is listed in each cell its bounding box covers. The entries are
+    sorted by cell id, ``cells`` holding the ids of the non-empty cells and
+    ``offsets`` the start of their entries in ``items``. With a cell size
+    close to the buffer distance, a query only visits a few cells around the
+    segment, whatever the density of the reference.
+    """
+
+    def __init__(self, bounds, cell_size):
+        """
+        Args:
+            bounds (array-like): (n, 4) bounding boxes of the items to index.
+            cell_size (float): Width and height of the cells.
+        """
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        self.cell_size = float(cell_size)
+        self.origin = np.zeros(2)
+        self.columns = self.rows = 0
+        self.items = np.zeros(0, dtype=np.int64)
+        self.cells = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        if not len(self.bounds):
+            return
+
+        self.origin = self.bounds[:, :2].min(axis=0)
+        first = self._cell(self.bounds[:, :2])
+        last = self._cell(self.bounds[:, 2:])
+        self.columns, self.rows = last.max(axis=0) + 1
+
+        # One entry per item and covered cell, walking the cells row by row
+        spans = last - first + 1
+        counts = spans[:, 0] * spans[:, 1]
+        items = np.repeat(np.arange(len(self.bounds)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        width = spans[items, 0]
+        columns = first[items, 0] + local % width
+        rows = first[items, 1] + local // width
+
+        cell_ids = rows * self.columns + columns
+        order = np.argsort(cell_ids, kind="stable")
+        self.items = items[order]
+        self.cells, starts = np.unique(cell_ids[order], return_index=True)
+        self.offsets = np.append(starts, len(order))
+
+    @classmethod
+    def for_buffer(cls, bounds, buffer_distance):
+        """
+        Creates a grid whose cells are sized for queries at buffer_distance.
+
+        The cells are at least as large as the typical item, so that long
+        items are not listed in too many cells.
+
+        Args:
+            bounds (array-like): (n, 4) bounding boxes of the items to index.
+            buffer_distance (float): The buffer distance of the queries.
+
+        Returns:
+            GridIndex: The grid.
+        """
+        bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+        extent = 0.0
+        if len(bounds):
+            extent = np.median(np.maximum(*(bounds[:, 2:] - bounds[:, :2]).T))
+        return cls(bounds, max(buffer_distance, extent, 1.0))
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def _cell(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Finds the items whose bounding box intersects a rectangle.
+
+        Returns:
+            ndarray: The indices of the matching items.
+        """
+        if not len(self.items):
+            return self.items
+
+        (x0, y0), (x1, y1) = self._cell(np.array([[xmin, ymin], [xmax, ymax]]))
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.columns - 1), min(y1, self.rows - 1)
+        if x0 > x1 or y0 > y1:
+            return self.items[:0]
+
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # Large rectangle, cheaper to scan the non-empty cells
+            columns = self.cells % self.columns
+            rows = self.cells // self.columns
+            found = np.flatnonzero(
+                (columns >= x0) & (columns <= x1) & (rows >= y0) & (rows <= y1)
+            )
+        else:
+            cell_ids = (
+                np.arange(y0, y1 + 1)[:, None] * self.columns + np.arange(x0, x1 + 1)
+            ).ravel()
+            found = np.searchsorted(self.cells, cell_ids)
+            found[found == len(self.cells)] = 0
+            found = found[self.cells[found] == cell_ids]
+        if not len(found):
+            return self.items[:0]
+
+        # Gather the entries of the found cells
+        entries = _ranges(self.offsets[found], self.offsets[found + 1])
+        items = np.unique(self.items[entries])
+        return items[_overlaps(self.bounds[items], xmin, ymin, xmax, ymax)]
+
+
+class ReferenceIndex:
+    """
+    Reference lines stored as flat edge arrays and indexed with an STR tree
+    or a uniform grid.
+
+    Proximity is tested exactly, as the minimum distance between the edges of
+    a segment and the edges of the candidate reference lines, the closest
+    candidates first so that the test usually stops at the first one. The
+    lines are split into pieces of chunk_length before they are indexed. The
+    grid is sized for the buffer distance, so it is built on the first query.
+
+    The arrays can be saved to a directory and memory-mapped back, see save
+    and load.
+
+    If stats is set to a RunStats, the candidate pieces and the pieces
+    tested exactly are counted in it.
+    """
+
+    ARRAYS = ("starts", "ends", "offsets", "bounds")
+
+    # Distances are exact, so a line out of reach has no segment within reach
+    exact = True
+
+    stats = None
+
+    def __init__(
+        self, parts, chunk_length=DEFAULT_REFERENCE_CHUNK_LENGTH, index=INDEX_RTREE
+    ):
+        """
+        Args:
+            parts (list): The reference lines, as (n, 2) arrays. Multi-part
+                features can simply contribute one entry per part.
+            chunk_length (float): Length of the indexed pieces, 0 to index
+                whole lines.
+            index (str): INDEX_RTREE or INDEX_GRID.
+        """
+        starts = []
+        ends = []
+        bounds = []
+        offsets = [0]
+
+        for part in segment_line(parts, chunk_length):
+            coords = np.asarray(part, dtype=float)[:, :2]
+            if not len(coords):
+                continue
+            part_starts, part_ends = _edges(coords)
+            starts.append(part_starts)
+            ends.append(part_ends)
+            bounds.append((*coords.min(axis=0), *coords.max(axis=0)))
+            offsets.append(offsets[-1] + len(part_starts))
+
+        self.starts = np.concatenate(starts) if starts else np.zeros((0, 2))
+        self.ends = np.concatenate(ends) if ends else np.zeros((0, 2))
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        self.index = index
+        self.tree = None if index == INDEX_GRID else STRtree(self.bounds)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def save(self, directory):
+        """
+        Saves the index arrays as .npy files.
+
+        The R-tree is saved with them, a grid is rebuilt after loading.
+
+        Args:
+            directory (str): The directory, created if needed.
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        meta = {"index": self.index, "levels": None}
+        if isinstance(self.tree, STRtree):
+            arrays["tree_items"] = self.tree.items
+            for level, bounds in enumerate(self.tree.levels):
+                arrays[f"tree_level_{level}"] = bounds
+            meta["levels"] = len(self.tree.levels)
+            meta["node_capacity"] = self.tree.node_capacity
+
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(directory, "index.json"), "w") as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads an index saved with save.
+
+        Args:
+            directory (str): The directory.
+            mmap (bool): Whether to memory-map the arrays instead of reading them.
+
+        Returns:
+            ReferenceIndex: The index.
+        """
+        mode = "r" if mmap else None
+
+        def read(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mode)
+
+        with open(os.path.join(directory, "index.json")) as f:
+            meta = json.load(f)
+
+        reference = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(reference, name, read(name))
+        reference.index = meta["index"]
+        reference.tree = None
+        if meta["levels"] is not None:
+            tree = STRtree.__new__(STRtree)
+            tree.node_capacity = meta["node_capacity"]
+            tree.items = read("tree_items")
+            tree.levels = [
+                read(f"tree_level_{level}") for level in range(meta["levels"])
+            ]
+            reference.tree = tree
+        return reference
+
+    def spatial_index(self, buffer_distance):
+        """
+        Returns the spatial index of the pieces, building the grid if needed.
+
+        Args:
+            buffer_distance (float): The buffer distance of the queries.
+
+        Returns:
+            STRtree or GridIndex: The index.
+        """
+        if self.index == INDEX_GRID and (
+            self.tree is None or self.tree.cell_size < buffer_distance
+        ):
+            self.tree = GridIndex.for_buffer(self.bounds, buffer_distance)
+        return self.tree
+
+    def part_edges(self, part, xmin, ymin, xmax, ymax):
+        """
+        Finds the edges of a reference part whose bounding box intersects a rectangle.
+
+        Returns:
+            ndarray: The indices of the edges.
+        """
+        edges = np.arange(self.offsets[part], self.offsets[part + 1])
+        starts = self.starts[edges]
+        ends = self.ends[edges]
+        edge_bounds = np.column_stack(
+            (np.minimum(starts, ends), np.maximum(starts, ends))
+        )
+        return edges[_overlaps(edge_bounds, xmin, ymin, xmax, ymax)]
+
+    def _candidates(self, coords, distance):
+        """
+        Finds the reference pieces that can be within distance of a segment.
+
+        Returns:
+            tuple: The candidate pieces, closest bounding box first, the lower
+                bounds of their distances and the query rectangle.
+        """
+        lower = coords.min(axis=0)
+        upper = coords.max(axis=0)
+        xmin, ymin = lower - distance
+        xmax, ymax = upper + distance
+
+        candidates = self.spatial_index(distance).query(xmin, ymin, xmax, ymax)
+        if self.stats is not None:
+            self.stats.count("candidates", len(candidates))
+        if not len(candidates):
+            return candidates, np.zeros(0), (xmin, ymin, xmax, ymax)
+
+        # Distance between the bounding boxes is a lower bound of the real one
+        gaps = np.maximum(
+            0.0,
+            np.maximum(
+                self.bounds[candidates, :2] - upper, lower - self.bounds[candidates, 2:]
+            ),
+        )
+        gaps = np.hypot(gaps[:, 0], gaps[:, 1])
+        order = np.argsort(gaps, kind="stable")
+        keep = gaps[order] <= distance
+        return candidates[order][keep], gaps[order][keep], (xmin, ymin, xmax, ymax)
+
+    def intersects(self, coords, buffer_distance):
+        """
+        Checks if any reference line is within buffer_distance of a segment.
+
+        Args:
+            coords (ndarray): The (n, 2) vertex coordinates of the segment.
+            buffer_distance (float): The buffer distance.
+
+        Returns:
+            bool: True if a reference line is within the buffer distance, False otherwise.
+        """
+        coords = np.asarray(coords, dtype=float)[:, :2]
+        candidates, _gaps, box = self._candidates(coords, buffer_distance)
+
+        segment_starts, segment_ends = _edges(coords)
+        for part in candidates:
+            edges = self.part_edges(part, *box)
+            if not len(edges):
+                continue
+            if self.stats is not None:
+                self.stats.count("exact_tests")
+            distances = segment_distances(
+                segment_starts, segment_ends, self.starts[edges], self.ends[edges]
+            )
+            if (distances <= buffer_distance).any():
+                return True
+
+        return False
+
+    def distance(self, coords, max_distance):
+        """
+        Computes the distance from a segment to the nearest reference line.
+
+        Candidates are visited closest bounding box first, and the search stops
+        as soon as no remaining candidate can be closer than the best distance.
+
+        Args:
+            coords (ndarray): The (n, 2) vertex coordinates of the segment.
+            max_distance (float): Distances above this one are not computed.
+
+        Returns:
+            float: The distance, None if it is above max_distance.
+        """
+        coords = np.asarray(coords, dtype=float)[:, :2]
+        candidates, gaps, box = self._candidates(coords, max_distance)
+
+        best = math.inf
+        segment_starts, segment_ends = _edges(coords)
+        for part, gap in zip(candidates, gaps):
+            if gap > best:
+                break
+            edges = self.part_edges(part, *box)
+            if not len(edges):
+                continue
+            if self.stats is not None:
+                self.stats.count("exact_tests")
+            distances = segment_distances(
+                segment_starts, segment_ends, self.starts[edges], self.ends[edges]
+            )
+            best = min(best, distances.min())
+
+        return float(best) if best <= max_distance else None
+
+    def points_within(self, points, buffer_distance):
+        """
+        Checks which points have a reference line within buffer_distance.
+
+        Args:
+            points (ndarray): The (n, 2) point coordinates.
+            buffer_distance (float): The buffer distance.
+
+        Returns:
+            ndarray: One boolean per point.
+        """
+        points = np.asarray(points, dtype=float)[:, :2]
+        within = np.zeros(len(points), dtype=bool)
+        if not len(points):
+            return within
+
+        # All the points are tested at once against the edges around them
+        xmin, ymin = points.min(axis=0) - buffer_distance
+        xmax, ymax = points.max(axis=0) + buffer_distance
+        parts = self.spatial_index(buffer_distance).query(xmin, ymin, xmax, ymax)
+        edges = _ranges(self.offsets[parts], self.offsets[parts + 1])
+        if not len(edges):
+            return within
+        if self.stats is not None:
+            self.stats.count("candidates", len(parts))
+            self.stats.count("exact_tests", len(parts))
+        starts = self.starts[edges][None]
+        ends = self.ends[edges][None]
+
+        # Bound the size of the distance matrices
+        step = max(1, POINTS_CHUNK_CELLS // len(edges))
+        for first in range(0, len(points), step):
+            distances = _point_segment_distances(
+                points[first : first + step, None, :], starts, ends
+            )
+            within[first : first + step] = (distances <= buffer_distance).any(axis=1)
+        return within
+
+
+def parse_distance(text):
+    """
+    Parses a distance, e.g. the max distance.
+
+    Args:
+        text (str): The distance.
+
+    Returns:
+        float: The distance.
+
+    Raises:
+        ValueError: If the distance is invalid, not finite or negative.
+    """
+    distance = float(text)
+    if not math.isfinite(distance):
+        raise ValueError("Distances must be finite")
+    if distance < 0:
+        raise ValueError("Distances must not be negative")
+    return distance
+
+
+def parse_distances(text):
+    """
+    Parses a comma separated list of buffer distances, e.g. "100, 500".
+
+    Args:
+        text (str): The distances.
+
+    Returns:
+        list: The distances, as floats, in the given order, without duplicates.
+
+    Raises:
+        ValueError: If the list is empty or a distance is invalid or negative.
+    """
+    distances = [parse_distance(item) for item in text.split(",") if item.strip()]
+    if not distances:
+        raise ValueError("No buffer distance given")
+    # Each distance gets its own output field
+    return list(dict.fromkeys(distances))
+
+
+def format_distance(distance):
+    """
+    Formats a distance without exponent, e.g. 100 as "100" and 1e-05 as "0.00001".
+
+    Args:
+        distance (float): The distance.
+
+    Returns:
+        str: The distance.
+    """
+    return np.format_float_positional(float(distance), trim="-")
+
+
+def search_distance(buffer_distance, max_distance=None):
+    """
+    Returns the largest distance at which reference lines are looked for.
+
+    Args:
+        buffer_distance (float or list): The buffer distance(s).
+        max_distance (float): Optional, the largest distance reported.
+
+    Returns:
+        float: The distance.
+    """
+    distances = list(np.atleast_1d(buffer_distance))
+    if max_distance is not None:
+        distances.append(max_distance)
+    return float(max(distances))
+
+
+def check_line(
+    parts, reference, buffer_distance, segment_length, max_distance=None, stats=None
+):
+    """
+    Segments a line and checks each segment against the reference.
+
+    With a max_distance, or several buffer distances, the distance to the
+    nearest reference line of an exact reference is computed once instead,
+    and compared to every buffer distance; any threshold up to max_distance
+    can be applied later. Other references, e.g. buffer polygons, test every
+    buffer distance like a single distance run, the distance being computed
+    only for max_distance.
+
+    Most lines are either matched or unmatched over their whole length, so
+    with an exact reference, e.g. a ReferenceIndex, the segments of a part
+    are first tested in blocks of PRETEST_BLOCK_SEGMENTS: if no reference line
+    is within reach of a block, none is within reach of its segments.
+    Otherwise, see check_segments.
+
+    Args:
+        parts (list): The parts of the line, as (n, 2) arrays.
+        reference: The reference to check against. Any object with an
+            ``intersects(coords, buffer_distance)`` method, e.g. a ReferenceIndex,
+            and a ``distance(coords, max_distance)`` one for the distance.
+        buffer_distance (float or list): The buffer distance, or a list of
+            buffer distances.
+        segment_length (float): The desired length of each segment.
+        max_distance (float): Optional, the largest distance reported.
+        stats (RunStats): Optional, receives the segmentation and proximity
+            timings and the number of segments.
+
+    Returns:
+        list: A list of (coords, intersects, distance) tuples, one per segment.
+            With a list of buffer distances, intersects is a tuple of booleans,
+            one per buffer distance. The distance is None if it is above
+            max_distance or not computed.
+    """
+    results = []
+    for part in parts:
+        if not len(part):
+            continue
+        start = time.perf_counter()
+        segments = segment_single_line(part, segment_length)
+        segmented = time.perf_counter()
+        results.extend(_check_part(segments, reference, buffer_distance, max_distance))
+        if stats is not None:
+            stats.add_time("segmentation", segmented - start)
+            stats.add_time("proximity", time.perf_counter() - segmented)
+            stats.count("segments", len(segments))
+    return results
+
+
+def _check_part(segments, reference, buffer_distance, max_distance):
+    """Checks the segments of a line part, see check_line."""
+    multiple = isinstance(buffer_distance, (list, tuple))
+    thresholds = buffer_distance if multiple else [buffer_distance]
+    cap = search_distance(buffer_distance, max_distance)
+
+    if max_distance is None and not multiple:
+        return list(
+            zip(
+                segments,
+                check_segments(segments, reference, buffer_distance),
+                itertools.repeat(None),
+            )
+        )
+
+    exact = getattr(reference, "exact", False)
+    unmatched = tuple(False for _threshold in thresholds)
+    results = []
+    for start, stop, reachable in _blocks(segments, reference, cap):
+        for segment in segments[start:stop]:
+            if not reachable:
+                results.append((segment, unmatched if multiple else False, None))
+                continue
+            if exact:
+                distance = reference.distance(segment, cap)
+                intersects = tuple(
+                    distance is not None and distance <= threshold
+                    for threshold in thresholds
+                )
+            else:
+                # Every buffer distance gets the test of a single distance run
+                intersects = tuple(
+                    reference.intersects(segment, threshold) for threshold in thresholds
+                )
+                distance = (
+                    reference.distance(segment, max_distance)
+                    if max_distance is not None
+                    else None
+                )
+            if distance is not None and (
+                max_distance is None or distance > max_distance
+            ):
+                distance = None
+            results.append(
+                (segment, intersects if multiple else intersects[0], distance)
+            )
+    return results
+
+
+def _blocks(segments, reference, distance):
+    """
+    Splits consecutive segments into blocks tested at once.
+
+    Only an exact reference is pretested, the segments otherwise form a
+    single block.
+
+    Yields:
+        tuple: (start, stop, reachable), reachable being False if no
+            reference line is within distance of any segment of the block.
+    """
+    if not getattr(reference, "exact", False):
+        yield 0, len(segments), True
+        return
+    for start in range(0, len(segments), PRETEST_BLOCK_SEGMENTS):
+        stop = min(start + PRETEST_BLOCK_SEGMENTS, len(segments))
+        # A single segment is tested on its own anyway
+        yield (
+            start,
+            stop,
+            stop - start == 1
+            or reference.intersects(_join(segments[start:stop]), distance),
+        )
+
+
+def check_segments(segments, reference, buffer_distance):
+    """
+    Checks the consecutive segments of a line part against the reference.
+
+    An exact reference, with an ``exact`` attribute set and a
+    ``points_within(points, buffer_distance)`` method, is tested by blocks,
+    see check_line. In a block within reach, the segments having an end point
+    within the buffer distance are matched without further test. The
+    remaining runs of segments are bisected: a run with no reference line
+    within the buffer distance is unmatched as a whole, and only single
+    segments are tested individually. Other references test every segment.
+
+    Args:
+        segments (list): The consecutive segments, as (n, 2) arrays.
+        reference: The reference to check against, see check_line.
+        buffer_distance (float): The buffer distance.
+
+    Returns:
+        list: The intersection results, one per segment.
+    """
+    if len(segments) < 2 or not getattr(reference, "exact", False):
+        return [reference.intersects(segment, buffer_distance) for segment in segments]
+
+    results = [False] * len(segments)
+
+    def bisect(start, stop, reachable=False):
+        if stop - start == 1:
+            results[start] = reference.intersects(segments[start], buffer_distance)
+        elif reachable or reference.intersects(
+            _join(segments[start:stop]), buffer_distance
+        ):
+            middle = (start + stop) // 2
+            bisect(start, middle)
+            bisect(middle, stop)
+
+    for first, last, reachable in _blocks(segments, reference, buffer_distance):
+        if not reachable:
+            continue
+        block = segments[first:last]
+        # The end points of consecutive segments are shared
+        points = np.array([segment[0] for segment in block] + [block[-1][-1]])
+        within = np.asarray(
+            reference.points_within(points, buffer_distance), dtype=bool
+        )
+        results[first:last] = within[:-1] | within[1:]
+
+        # Runs of segments with no end point within the buffer distance
+        undecided = np.flatnonzero(~(within[:-1] | within[1:])) + first
+        if len(undecided):
+            breaks = np.flatnonzero(np.diff(undecided) > 1) + 1
+            for run in np.split(undecided, breaks):
+                # The pretest already found a reference line near the block
+                bisect(run[0], run[-1] + 1, len(run) == last - first)
+
+    return [bool(result) for result in results]
+
+
+def _join(segments):
+    """Joins consecutive segments, sharing their end points, into one line."""
+    return np.concatenate([segments[0]] + [segment[1:] for segment in segments[1:]])
+
+
+def check_lines(
+    lines, reference, buffer_distance, segment_length, max_distance=None, stats=None
+):
+    """
+    Segments lines and checks each segment against the reference.
+
+    Args:
+        lines (iterable): (fid, parts) tuples, parts being (n, 2) arrays.
+        reference: The reference to check against, see check_line.
+        buffer_distance (float or list): The buffer distance(s), see check_line.
+        segment_length (float): The desired length of each segment.
+        max_distance (float): Optional, the largest distance reported.
+        stats (RunStats): Optional, see check_line.
+
+    Yields:
+        tuple: (fid, coords, intersects, distance) for every segment.
+    """
+    for fid, parts in lines:
+        for segment, intersects, distance in check_line(
+            parts, reference, buffer_distance, segment_length, max_distance, stats
+        ):
+            yield fid, segment, intersects, distance
+
+
+def check_lines_parallel(
+    lines,
+    reference,
+    buffer_distance,
+    segment_length,
+    workers=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    max_distance=None,
+    stats=None,
+):
+    """
+    Same as check_lines, spreading the lines over a pool of processes.
+
+    The lines are sent to the workers in chunks of consecutive lines and the
+    results are yielded in the input order, whatever the number of workers.
+
+    Args:
+        lines (iterable): (fid, parts) tuples, parts being (n, 2) arrays.
+        reference: The reference to check against, see check_line. It is
+            copied once to every worker, so it must be picklable, e.g. a
+            ReferenceIndex.
+        buffer_distance (float or list): The buffer distance(s), see check_line.
+        segment_length (float): The desired length of each segment.
+        workers (int): Number of processes, defaults to the number of CPUs.
+        chunk_size (int): Number of lines per chunk.
+        max_distance (float): Optional, the largest distance reported.
+        stats (RunStats): Optional, receives the statistics of the workers,
+            see check_line. The reference counters are collected too.
+
+    Yields:
+        tuple: (fid, coords, intersects, distance) for every segment.
+    """
+    workers = workers or os.cpu_count() or 1
+    lines = iter(lines)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=_process_context(),
+        initializer=_init_worker,
+        initargs=(reference,),
+    ) as executor:
+        pending = deque()
+        try:
+            while True:
+                chunk = list(itertools.islice(lines, chunk_size))
+                if chunk:
+                    pending.append(
+                        executor.submit(
+                            _check_chunk,
+                            chunk,
+                            buffer_distance,
+                            segment_length,
+                            max_distance,
+                            stats is not None,
+                        )
+                    )
+                # Keep a few chunks queued per worker, but no more
+                if pending and (not chunk or len(pending) >= 2 * workers):
+                    results, chunk_stats = pending.popleft().result()
+                    if stats is not None:
+                        stats.merge(chunk_stats)
+                    yield from results
+                elif not chunk:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _process_context():
+    context = multiprocessing.get_context("spawn")
+
+    # Embedded interpreters, e.g. QGIS desktop, report their own binary
+    if not os.path.basename(sys.executable).lower().startswith("python"):
+        for executable in (
+            os.path.join(sys.exec_prefix, "python.exe"),
+            os.path.join(sys.exec_prefix, "bin", "python3"),
+        ):
+            if os.path.exists(executable):
+                context.set_executable(executable)
+                break
+
+    return context
+
+
+_worker_reference = None
+
+
+def _init_worker(reference):
+    global _worker_reference
+    _worker_reference = reference
+
+
+def _check_chunk(chunk, buffer_distance, segment_length, max_distance, with_stats):
+    stats = RunStats() if with_stats else None
+    if hasattr(_worker_reference, "stats"):
+        _worker_reference.stats = stats
+    results = list(
+        check_lines(
+            chunk,
+            _worker_reference,
+            buffer_distance,
+            segment_length,
+            max_distance,
+            stats,
+        )
+    )
+    return results, stats.as_dict() if stats is not None else None
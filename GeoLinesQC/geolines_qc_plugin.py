@@ -2,46 +2,75 @@
 
 
 import os
+import tempfile
 from datetime import datetime
+from functools import partial
 
-from qgis import processing
 from qgis.core import (
     Qgis,
-    QgsFeature,
-    QgsField,
-    QgsGeometry,
+    QgsApplication,
     QgsMessageLog,
-    QgsPoint,
     QgsProject,
-    QgsSpatialIndex,
-    QgsVectorLayer,
-    QgsWkbTypes,
-    QgsProcessingFeatureSourceDefinition,
 )
-from qgis.PyQt.QtCore import QCoreApplication, Qt, QVariant
+from qgis.gui import QgsFileWidget
+from qgis.PyQt.QtCore import QCoreApplication, Qt
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import (
     QApplication,
     QAction,
+    QCheckBox,
     QComboBox,
     QDialog,
     QLabel,
     QLineEdit,
-    QProgressDialog,
     QPushButton,
     QVBoxLayout,
 )
 
+from .analysis import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_UPDATE_RATE,
+    METHOD_LABELS,
+    GeolinesQCTask,
+    create_output_layer,
+    intersects_fields,
+    load_output_file,
+)
+from .engine import (
+    DEFAULT_BUFFER,
+    DEFAULT_SEGMENT_LENGTH,
+    METHOD_BUFFER,
+    format_distance,
+    parse_distance,
+    parse_distances,
+)
+from .incremental import (
+    find_previous_output,
+    patch_output_layer,
+    run_parameters,
+    save_state,
+)
+from .log import flush_logs, setup_logging, teardown_logging
+from .processing_provider import GeolinesQCProvider
+from .profiling import create_profiler
+from .reference import check_reference_crs
+from .stats import RunStats
+from .utils import ClipError, RateLimiter, RegionMask, read_setting
 
 
-DEFAULT_BUFFER = 500.0
-DEFAULT_SEGMENT_LENGTH = 200.0
+DEFAULT_METHOD = METHOD_BUFFER
 
-ADD_CLIPPED_LAYER_TO_MAP = False
 DIALOG_WIDTH = 400
 
+# Maximum number of info messages pushed to the message bar per second, the
+# others are shown in the status bar
+INFO_MESSAGE_RATE = 1
+
+# Formats the segments can be streamed to, instead of a memory layer
+OUTPUT_FILE_FILTER = "GeoPackage (*.gpkg);;FlatGeobuf (*.fgb)"
+
 # Enable high DPI scaling
-if hasattr(QApplication, 'setAttribute'):
+if hasattr(QApplication, "setAttribute"):
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
     QApplication.setAttribute(Qt.AA_UseHighDpiPixmaps, True)
 
@@ -49,12 +78,6 @@ if hasattr(QApplication, 'setAttribute'):
 os.environ["QT_AUTO_SCREEN_SCALE_FACTOR"] = "1"
 
 
-class ClipError(Exception):
-    """Custom exception for clipping operations"""
-
-    pass
-
-
 class GeolinesQCPlugin:
     def __init__(self, iface):
         self.iface = iface
@@ -64,11 +87,20 @@ class GeolinesQCPlugin:
         self.predefined_geometries = {}
         # Get the path to your plugin directory
         self.styles_dir = os.path.join(self.plugin_dir, "styles")
+        self.info_messages = RateLimiter(INFO_MESSAGE_RATE)
 
     def tr(self, message):
         return QCoreApplication.translate("GeoLinesQC", message)
 
+    def initProcessing(self):
+        # Register the algorithm in the processing toolbox
+        self.provider = GeolinesQCProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
     def initGui(self):
+        setup_logging()
+        self.initProcessing()
+
         # Create action for the plugin
         self.action = QAction(
             QIcon(":/plugins/GeoLinesQC/icons8-line-chart-50.png"),
@@ -83,6 +115,8 @@ class GeolinesQCPlugin:
         # Remove plugin menu and icon
         self.iface.removePluginMenu("&GeoLines QC", self.action)
         self.iface.removeToolBarIcon(self.action)
+        QgsApplication.processingRegistry().removeProvider(self.provider)
+        teardown_logging()
 
     """def get_predefined_geometries(self):
         # Load the GPGK file
@@ -144,11 +178,7 @@ class GeolinesQCPlugin:
 
     def run(self):
         # Create and show the dialog
-        self.iface.messageBar().pushMessage(
-            "Info",
-            "Open dialog...",
-            level=Qgis.Info,
-        )
+        self.push_info("Open dialog...")
         self.dialog = QDialog()
         self.dialog.setWindowTitle("GeoLines QC")
         self.dialog.setFixedWidth(DIALOG_WIDTH)
@@ -159,13 +189,27 @@ class GeolinesQCPlugin:
         self.layer2_combo = QComboBox()
         self.threshold_input = QLineEdit()
         self.threshold_input.setPlaceholderText(
-            f"Optional: buffer distance [m] (default: {DEFAULT_BUFFER})"
+            f"Optional: buffer distance(s) [m], e.g. 100, 500 (default: {DEFAULT_BUFFER})"
         )
         self.segment_length_input = QLineEdit()
         self.segment_length_input.setPlaceholderText(
             f"Optional: segment length [m] (default: {DEFAULT_SEGMENT_LENGTH})"
         )
+        self.max_distance_input = QLineEdit()
+        self.max_distance_input.setPlaceholderText(
+            "Optional: store distances up to [m] (default: none)"
+        )
+        self.output_file_widget = QgsFileWidget()
+        self.output_file_widget.setStorageMode(QgsFileWidget.SaveFile)
+        self.output_file_widget.setFilter(OUTPUT_FILE_FILTER)
+        self.output_file_widget.lineEdit().setPlaceholderText(
+            "Optional: output file (default: temporary layer)"
+        )
         self.geometry_combo = QComboBox()
+        self.method_combo = QComboBox()
+        for method, label in METHOD_LABELS.items():
+            self.method_combo.addItem(label, method)
+        self.method_combo.setCurrentIndex(self.method_combo.findData(DEFAULT_METHOD))
 
         layout.addWidget(QLabel("Layer to Check:"))
         layout.addWidget(self.layer1_combo)
@@ -175,8 +219,18 @@ class GeolinesQCPlugin:
         layout.addWidget(self.threshold_input)
         layout.addWidget(QLabel("Segment Length:"))
         layout.addWidget(self.segment_length_input)
+        layout.addWidget(QLabel("Proximity Test:"))
+        layout.addWidget(self.method_combo)
+        layout.addWidget(QLabel("Distance Output:"))
+        layout.addWidget(self.max_distance_input)
         layout.addWidget(QLabel("Region layer:"))
         layout.addWidget(self.geometry_combo)
+        layout.addWidget(QLabel("Output File:"))
+        layout.addWidget(self.output_file_widget)
+        self.incremental_checkbox = QCheckBox(
+            "Only re-check the features edited since the last run"
+        )
+        layout.addWidget(self.incremental_checkbox)
 
         layers = QgsProject.instance().layerTreeRoot().children()
         self.layer1_combo.clear()
@@ -198,59 +252,6 @@ class GeolinesQCPlugin:
         self.dialog.setLayout(layout)
         self.dialog.exec_()
 
-    def clip_layer_with_processing(self, layer, region_layer, layer_name):
-        """
-        Clips a layer using selected features from region_layer or the whole layer if nothing is selected.
-
-        Args:
-            layer: Input layer to be clipped
-            region_layer: Layer containing the clip features
-            layer_name: Name for the output layer
-
-        Returns:
-            QgsVectorLayer: The clipped layer
-
-        Raises:
-            ClipError: If the resulting layer is empty or invalid
-        """
-        # Create the processing parameters
-        params = {"INPUT": layer, "OUTPUT": "memory:" + layer_name}
-
-        # Check if there are selected features
-        if region_layer.selectedFeatureCount() > 0:
-            # Use only selected features for clipping
-            self.log_debug(
-                f"Using {region_layer.selectedFeatureCount()} selected features for clipping"
-            )
-            params["OVERLAY"] = QgsProcessingFeatureSourceDefinition(
-                region_layer.id(), selectedFeaturesOnly=True
-            )
-        else:
-            # Use all features if nothing is selected
-            self.log_debug("No features selected, using entire overlay layer")
-            params["OVERLAY"] = region_layer
-
-        # Run the clip processing algorithm
-        result = processing.run("native:clip", params)
-
-        # Get the output layer
-        clipped_layer = result["OUTPUT"]
-
-        # If the result is a string (file path) load it as a layer
-        if isinstance(clipped_layer, str):
-            clipped_layer = QgsVectorLayer(clipped_layer, layer_name, "ogr")
-
-        # Check if the layer is valid and has features
-        if not clipped_layer.isValid():
-            raise ClipError("Failed to create valid clipped layer")
-
-        if clipped_layer.featureCount() == 0:
-            raise ClipError(
-                "Clipping resulted in empty layer - no overlapping features found"
-            )
-
-        return clipped_layer
-
     def analyze_layers(self):
         # Get selected layers
         # TODO check validiy
@@ -258,10 +259,23 @@ class GeolinesQCPlugin:
         layer1_name = self.layer1_combo.currentText()
         layer2_name = self.layer2_combo.currentText()
         mask_layer_name = self.geometry_combo.currentText()
+        # Several comma separated distances are checked in a single pass
+        try:
+            buffer_distances = (
+                parse_distances(self.threshold_input.text())
+                if self.threshold_input.text().strip()
+                else [DEFAULT_BUFFER]
+            )
+        except ValueError as e:
+            self.iface.messageBar().pushMessage(
+                "Error", f"Invalid buffer distance: {e}", level=Qgis.Critical
+            )
+            return
         buffer_distance = (
-            float(self.threshold_input.text())
-            if self.threshold_input.text()
-            else DEFAULT_BUFFER
+            buffer_distances[0] if len(buffer_distances) == 1 else buffer_distances
+        )
+        buffer_label = ", ".join(
+            format_distance(distance) for distance in buffer_distances
         )
 
         segment_length = (
@@ -269,174 +283,275 @@ class GeolinesQCPlugin:
             if self.segment_length_input.text()
             else DEFAULT_SEGMENT_LENGTH
         )
+        method = self.method_combo.currentData()
+        try:
+            max_distance = (
+                parse_distance(self.max_distance_input.text())
+                if self.max_distance_input.text().strip()
+                else None
+            )
+        except ValueError as e:
+            self.iface.messageBar().pushMessage(
+                "Error", f"Invalid max distance: {e}", level=Qgis.Critical
+            )
+            return
 
-        self.iface.messageBar().pushMessage(
-            "Info",
-            "Loading data...",
-            level=Qgis.Info,
-        )
-
-        input_layer_full = QgsProject.instance().mapLayersByName(layer1_name)[0]
-        reference_layer_full = QgsProject.instance().mapLayersByName(layer2_name)[0]
+        self.push_info("Loading data...")
 
-        # Get the selected region layer
-        """region_geometry = (
-            self.get_selected_geometry()
-        )  # Assuming this returns a QgsVectorLayer"""
+        input_layer = QgsProject.instance().mapLayersByName(layer1_name)[0]
+        reference_layer = QgsProject.instance().mapLayersByName(layer2_name)[0]
+        try:
+            check_reference_crs(input_layer.crs(), reference_layer.crs())
+        except ValueError as e:
+            self.iface.messageBar().pushMessage("Error", str(e), level=Qgis.Critical)
+            return
+        stats = RunStats()
 
         if mask_layer_name == "None":
-            self.iface.messageBar().pushMessage(
-                "Info",
-                "No region selected. Using the full dataset",
-                level=Qgis.Info,
-            )
-            input_layer = input_layer_full
-            reference_layer = reference_layer_full
+            self.push_info("No region selected. Using the full dataset")
+            mask = None
         else:
-            self.iface.messageBar().pushMessage(
-                "Info",
-                "Clipping data...",
-                level=Qgis.Info,
-            )
-            # Convert the region geometry to a vector layer
-            # region_layer = geometry_to_vector_layer(region_geometry, "Selected Region")
+            # Both layers are clipped with the region while they are read
             region_layer = QgsProject.instance().mapLayersByName(mask_layer_name)[0]
-            # Clip layer1 to the selected region
             try:
-                input_layer = self.clip_layer_with_processing(
-                    input_layer_full, region_layer, f"Clipped {layer1_name}"
-                )
-
+                with stats.stage("clip"):
+                    mask = RegionMask.from_layer(region_layer, input_layer.crs())
             except ClipError as e:
                 self.iface.messageBar().pushMessage(
                     "Error", str(e), level=Qgis.Critical
                 )
-            except Exception as e:
-                self.iface.messageBar().pushMessage(
-                    "Error",
-                    f"Unexpected error during clipping: {str(e)}",
-                    level=Qgis.Critical,
+                return
+
+        # An output of a run with the same parameters is patched, if asked for
+        parameters = run_parameters(
+            input_layer,
+            reference_layer,
+            buffer_distance,
+            segment_length,
+            method,
+            max_distance,
+            mask,
+        )
+        previous_layer = previous_hashes = None
+        if self.incremental_checkbox.isChecked():
+            previous_layer, previous_hashes = find_previous_output(parameters)
+            if previous_layer is None:
+                self.push_info(
+                    "No previous run with the same parameters, checking all features"
                 )
 
-            # TODO
-            if ADD_CLIPPED_LAYER_TO_MAP and input_layer:
-                QgsProject.instance().addMapLayer(input_layer)
+        # Large runs are streamed to a file, smaller ones kept in memory
+        output_path = self.output_file_widget.filePath().strip() or None
+        output_layer = output_name = None
+        if previous_layer is not None:
+            # The segments of the edited features are collected in memory
+            output_path = None
+            output_layer = create_output_layer(
+                input_layer.crs(),
+                previous_layer.name(),
+                with_distance=max_distance is not None,
+                buffer_distance=buffer_distance,
+            )
+        elif output_path:
+            if not os.path.splitext(output_path)[1]:
+                output_path += ".gpkg"
+            output_name = os.path.splitext(os.path.basename(output_path))[0]
+        else:
+            # Create a new memory layer to store the segmented lines with intersection results
+            output_layer = create_output_layer(
+                input_layer.crs(),
+                f"{layer1_name} — {layer2_name} {buffer_label}",
+                with_distance=max_distance is not None,
+                buffer_distance=buffer_distance,
+            )
+
+        QgsMessageLog.logMessage(
+            f"Buffer distance: {buffer_label}, segment length={segment_length}, method={method}",
+            "GeoLinesQC",
+            level=Qgis.Info,
+        )
 
-            # Clip layer2 to the selected region
+        # The run is profiled if asked for, the profile saved next to the output
+        profiler = profile_path = None
+        profiler_kind = read_setting("profiler", "")
+        if profiler_kind:
             try:
-                reference_layer = self.clip_layer_with_processing(
-                    reference_layer_full, region_layer, f"Clipped {layer2_name}"
+                profiler = create_profiler(profiler_kind)
+            except ValueError as e:
+                QgsMessageLog.logMessage(str(e), "GeoLinesQC", level=Qgis.Warning)
+            else:
+                profile_path = (
+                    os.path.splitext(output_path)[0]
+                    if output_path
+                    else os.path.join(
+                        tempfile.gettempdir(),
+                        f"geolinesqc-{datetime.now():%Y%m%d-%H%M%S}",
+                    )
                 )
 
-            except ClipError as e:
-                self.iface.messageBar().pushMessage(
-                    "Error", str(e), level=Qgis.Critical
-                )
-            except Exception as e:
-                self.iface.messageBar().pushMessage(
-                    "Error",
-                    f"Unexpected error during clipping: {str(e)}",
-                    level=Qgis.Critical,
-                )
-            if ADD_CLIPPED_LAYER_TO_MAP and reference_layer:
-                QgsProject.instance().addMapLayer(reference_layer)
-
-        # Create a new memory layer to store the segmented lines with intersection results
-        output_layer = QgsVectorLayer(
-            "LineString?crs=" + input_layer.crs().authid(),
-            f"{layer1_name} — {layer2_name} {buffer_distance}",
-            "memory",
+        # Run the analysis in the background, QGIS stays usable meanwhile
+        self.task = GeolinesQCTask(
+            f"GeoLines QC: {layer1_name}",
+            input_layer,
+            reference_layer,
+            output_layer,
+            buffer_distance,
+            segment_length,
+            method,
+            batch_size=read_setting("batch_size", DEFAULT_BATCH_SIZE, int),
+            workers=read_setting("workers", 1, int),
+            mask=mask,
+            max_distance=max_distance,
+            output_path=output_path,
+            output_name=output_name,
+            previous_hashes=previous_hashes,
+            stats=stats,
+            profiler=profiler,
+            profile_path=profile_path,
+            update_rate=read_setting("update_rate", DEFAULT_UPDATE_RATE, float),
         )
-        output_layer.dataProvider().addAttributes(
-            [
-                QgsField("id", QVariant.Int),
-                QgsField(
-                    "intersects", QVariant.Bool
-                ),  # Add a field to store intersection results
-            ]
+        self.task.segmentsWritten.connect(self.show_partial_counts)
+        self.task.taskCompleted.connect(
+            partial(self.on_analysis_completed, self.task, parameters, previous_layer)
         )
-        output_layer.updateFields()
-        self.iface.messageBar().pushMessage(
-            "Info",
-            "Starting analysis...",
-            level=Qgis.Info,
+        self.task.taskTerminated.connect(
+            partial(self.on_analysis_terminated, self.task)
         )
+        QgsApplication.taskManager().addTask(self.task)
 
-        # Initialize progress dialog
-        progress = QProgressDialog(
-            "Processing features...",
-            "Cancel",
-            0,
-            input_layer.featureCount(),
-            self.iface.mainWindow(),
-        )
-        progress.setWindowTitle("Analyzing Layers")
-        progress.setWindowModality(
-            Qt.WindowModal
-        )  # Make the dialog block the main window
-        progress.setMinimumDuration(0)  # Show the dialog immediately
+        self.push_info("Analysis started in the background...")
+        self.dialog.close()
 
-        # Segment each feature in the input layer
-        # segment_length = 100.0  # Desired segment length
-        # buffer_distance = 500.0  # Buffer distance for intersection check
+    def push_info(self, message):
+        """
+        Shows an info message in the message bar, or in the status bar if
+        another one was pushed less than a second ago, so that messages in a
+        row do not pile up.
 
-        QgsMessageLog.logMessage(
-            f"Buffer distance: {buffer_distance}, segment length={segment_length}",
-            "GeoLinesQC",
-            level=Qgis.Info,
+        Args:
+            message (str): The message.
+        """
+        if self.info_messages.ready():
+            self.iface.messageBar().pushMessage("Info", message, level=Qgis.Info)
+        else:
+            self.iface.statusBarIface().showMessage(f"GeoLines QC: {message}", 5000)
+
+    def show_partial_counts(self, features, segments, intersecting):
+        """Shows the progress of the running analysis in the status bar."""
+        self.iface.statusBarIface().showMessage(
+            f"GeoLines QC: {features} features, {segments} segments, "
+            f"{intersecting} intersecting"
         )
 
-        for i, feature in enumerate(input_layer.getFeatures()):
-            # Update progress bar
-            if i % 10 == 0:
-                progress.setValue(i)
-            if progress.wasCanceled():
+    def on_analysis_completed(self, task, parameters, previous_layer=None):
+        """
+        Adds the styled output layer once the background analysis succeeded,
+        or patches the output of the previous run in incremental mode.
+        """
+        self.iface.statusBarIface().clearMessage()
+        flush_logs()
+        features, segments, intersecting = task.counts
+
+        if previous_layer is not None:
+            try:
+                with task.stats.stage("write"):
+                    patch_output_layer(
+                        previous_layer, task.stale_ids, task.output_layer.getFeatures()
+                    )
+            except OSError as e:
                 self.iface.messageBar().pushMessage(
-                    "Warning",
-                    "Operation canceled by user.",
-                    level=Qgis.Warning,
-                )
-                break
-            line_geometry = feature.geometry()
-            segments = self.segment_line(line_geometry, segment_length)
-
-            # Add each segment to the output layer with intersection results
-            for segment in segments:
-                new_feature = QgsFeature(output_layer.fields())
-                new_feature.setGeometry(segment)
-
-                # Check for intersections with the reference layer
-                intersects = self.buffer_and_check_intersections(
-                    segment, reference_layer, buffer_distance
+                    "Error",
+                    f"Cannot update layer {previous_layer.name()}: {e}",
+                    level=Qgis.Critical,
                 )
-                new_feature.setAttribute("intersects", intersects)
+                return
+            save_state(previous_layer, parameters, task.hashes)
+            self.report_stats(task.stats, parameters)
+            self.iface.messageBar().pushMessage(
+                "Success",
+                f"Incremental check complete ({features} new or edited features, "
+                f"{segments} segments, {intersecting} intersecting). "
+                f"Layer {previous_layer.name()} updated.",
+                level=Qgis.Success,
+            )
+            return
 
-                output_layer.dataProvider().addFeature(new_feature)
+        output_layer = task.output_layer
+        if task.output_path:
+            try:
+                output_layer = load_output_file(task.output_path, task.output_name)
+            except OSError as e:
+                self.iface.messageBar().pushMessage(
+                    "Error", str(e), level=Qgis.Critical
+                )
+                return
+        save_state(output_layer, parameters, task.hashes)
 
-        self.iface.messageBar().pushMessage(
-            "Info",
-            "Segmentation and intersection check complete. Output layer added to the map.",
-            level=Qgis.Info,
-        )
-        # Close the progress dialog
-        progress.setValue(input_layer.featureCount())
         self.iface.messageBar().pushMessage(
             "Success",
-            "Segmentation and intersection check complete. Output layer added to the map.",
+            f"Segmentation and intersection check complete ({features} features, "
+            f"{segments} segments, {intersecting} intersecting). "
+            "Output layer added to the map.",
             level=Qgis.Success,
         )
         # Load style and add to map
-        self.add_styled_layer(output_layer, "intersects")
+        with task.stats.stage("styling"):
+            self.add_styled_layer(
+                output_layer,
+                "intersects",
+                class_attribute=intersects_fields(task.buffer_distance)[0],
+            )
+        self.report_stats(task.stats, parameters)
 
-        self.dialog.close()
+    def report_stats(self, stats, parameters):
+        """
+        Logs the timings and counters of a run, and writes them to the JSON
+        report set by the "stats_report" setting, if any.
+
+        Args:
+            stats (RunStats): The statistics of the run.
+            parameters (dict): The parameters of the run, added to the report.
+        """
+        QgsMessageLog.logMessage(
+            f"Run statistics: {stats.summary()}", "GeoLinesQC", level=Qgis.Info
+        )
+        report_path = read_setting("stats_report", "")
+        if not report_path:
+            return
+        try:
+            stats.write_json(report_path, parameters=parameters)
+        except OSError as e:
+            QgsMessageLog.logMessage(
+                f"Cannot write the statistics report {report_path}: {e}",
+                "GeoLinesQC",
+                level=Qgis.Warning,
+            )
 
-    def add_styled_layer(self, layer, style_name):
+    def on_analysis_terminated(self, task):
+        """Reports a canceled or failed background analysis."""
+        self.iface.statusBarIface().clearMessage()
+        flush_logs()
+        if task.exception is None:
+            self.iface.messageBar().pushMessage(
+                "Warning",
+                "Operation canceled by user.",
+                level=Qgis.Warning,
+            )
+        else:
+            self.iface.messageBar().pushMessage(
+                "Error",
+                f"Analysis failed: {task.exception}",
+                level=Qgis.Critical,
+            )
+
+    def add_styled_layer(self, layer, style_name, class_attribute=None):
         """
         Add a layer to the map with a predefined style
 
         Args:
             layer: QgsVectorLayer to add
             style_name: Name of the style file (without .qml extension)
+            class_attribute: Optional, field classified by the style's renderer
         """
         # Construct path to style file
         style_path = os.path.join(self.styles_dir, f"{style_name}.qml")
@@ -454,218 +569,10 @@ class GeolinesQCPlugin:
             self.iface.messageBar().pushMessage(
                 "Style Error", f"Failed to load style: {success[0]}", level=Qgis.Warning
             )
+        elif class_attribute is not None and hasattr(
+            layer.renderer(), "setClassAttribute"
+        ):
+            layer.renderer().setClassAttribute(class_attribute)
 
         # Add layer to the map
         QgsProject.instance().addMapLayer(layer)
-
-    def log_debug(self, message, show_in_bar=False):
-        """Unified logging function that writes to both log file and QGIS log"""
-        # Log to QGIS Message Log
-        QgsMessageLog.logMessage(message, "segment_line", level=Qgis.Info)
-
-        # Optionally show in message bar
-        if show_in_bar:
-            self.iface.messageBar().pushMessage("Debug", message, level=Qgis.Info)
-
-        # Log to file
-        log_dir = os.path.join(os.path.dirname(__file__), "logs")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
-
-        log_file = os.path.join(log_dir, "segment_line_debug.log")
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        with open(log_file, "a") as f:
-            f.write(f"{timestamp}: {message}\n")
-
-    def segment_line(self, line, segment_length):
-        """
-        Splits a line into segments of equal length using QGIS native functions.
-        Handles both single LineString and MultiLineString geometries.
-
-        Args:
-            line (QgsGeometry): The input line geometry (can be LineString or MultiLineString).
-            segment_length (float): The desired length of each segment.
-        Returns:
-            list: A list of QgsGeometry objects representing the segments.
-        """
-        try:
-            new_segments = []
-
-            # Check geometry type
-            geom_type = line.wkbType()
-            # self.log_debug(
-            #    f"Processing geometry type: {QgsWkbTypes.displayString(geom_type)}"
-            # )
-
-            # Handle MultiLineString
-            if QgsWkbTypes.isMultiType(geom_type):
-                # self.log_debug("Processing MultiLineString geometry")
-                for part in line.asGeometryCollection():
-                    # self.log_debug(f"Processing part with length: {part.length()}")
-                    segments = self.segment_single_line(part, segment_length)
-                    new_segments.extend(segments)
-            # Handle single LineString
-            else:
-                # self.log_debug("Processing single LineString geometry")
-                new_segments = self.segment_single_line(line, segment_length)
-
-            summary = f"\nTotal segments created: {len(new_segments)}"
-            for idx, seg in enumerate(new_segments):
-                summary += f"\nSegment {idx} length: {seg.length()}"
-            # self.log_debug(summary)
-
-            return new_segments
-
-        except Exception as e:
-            import traceback
-
-            error_msg = f"Error: {str(e)}\nTraceback:\n{traceback.format_exc()}"
-            self.log_debug(error_msg, show_in_bar=True)
-            return [line]
-
-    def segment_single_line(self, line, segment_length):
-        """
-        Splits a single LineString geometry into segments.
-
-        Args:
-            line (QgsGeometry): The input LineString geometry.
-            segment_length (float): The desired length of each segment.
-        Returns:
-            list: A list of QgsGeometry objects representing the segments.
-        """
-        try:
-            # Debug: Log input parameters
-            # self.log_debug(f"Input line length: {line.length()}")
-            # self.log_debug(f"Requested segment length: {segment_length}")
-
-            # Extract vertices from the line
-            vertices = line.asPolyline()
-            # self.log_debug(f"Number of vertices in input line: {len(vertices)}")
-
-            if len(vertices) < 2:
-                # msg = "Invalid line: Not enough vertices."
-                # self.log_debug(msg, show_in_bar=True)
-                return [line]
-
-            new_segments = []
-            current_segment = [QgsPoint(vertices[0])]
-            accumulated_length = 0.0
-
-            for i in range(1, len(vertices)):
-                prev_point = QgsPoint(vertices[i - 1])
-                current_point = QgsPoint(vertices[i])
-                segment = QgsGeometry.fromPolyline([prev_point, current_point])
-                segment_length_current = segment.length()
-
-                # self.log_debug(f"Processing vertex {i}:")
-                # self.log_debug(f"Current segment length: {segment_length_current}")
-                # self.log_debug(
-                #     f"Accumulated length before processing: {accumulated_length}"
-                # )
-
-                while accumulated_length + segment_length_current >= segment_length:
-                    remaining_length = segment_length - accumulated_length
-                    # self.log_debug(
-                    #    f"Splitting segment - Remaining length: {remaining_length}"
-                    # )
-
-                    if remaining_length <= 0:
-                        # self.log_debug(
-                        #    "Warning: Remaining length is zero or negative",
-                        #    show_in_bar=True,
-                        # )
-                        break
-
-                    if remaining_length >= segment_length_current:
-                        # self.log_debug(
-                        #    "Warning: Remaining length exceeds current segment length",
-                        #    show_in_bar=True,
-                        # )
-                        break
-
-                    cut_point = segment.interpolate(remaining_length).asPoint()
-                    # self.log_debug(
-                    #    f"Cut point created at: ({cut_point.x()}, {cut_point.y()})"
-                    # )
-
-                    current_segment.append(QgsPoint(cut_point))
-                    new_segment = QgsGeometry.fromPolyline(current_segment)
-                    # self.log_debug(f"New segment length: {new_segment.length()}")
-                    new_segments.append(new_segment)
-
-                    current_segment = [QgsPoint(cut_point)]
-                    accumulated_length = 0.0
-
-                    segment = QgsGeometry.fromPolyline(
-                        [QgsPoint(cut_point), current_point]
-                    )
-                    segment_length_current = segment.length()
-                    # self.log_debug(
-                    #    f"Remaining segment length after cut: {segment_length_current}"
-                    # )
-
-                current_segment.append(current_point)
-                accumulated_length += segment_length_current
-                # self.log_debug(
-                #    f"Accumulated length after processing: {accumulated_length}"
-                # )
-
-            # Add the last segment if it has more than one point
-            if len(current_segment) > 1:
-                final_segment = QgsGeometry.fromPolyline(current_segment)
-                # self.log_debug(
-                #    f"Adding final segment with length: {final_segment.length()}"
-                # )
-                new_segments.append(final_segment)
-
-            return new_segments
-
-        except Exception as e:
-            import traceback
-
-            error_msg = f"Error in segment_single_line: {str(e)}\nTraceback:\n{traceback.format_exc()}"
-            self.log_debug(error_msg, show_in_bar=True)
-            return [line]
-
-    def buffer_and_check_intersections(self, segment, reference_layer, buffer_distance):
-        """
-        Buffers a segment and checks if it intersects with any features in a reference layer.
-
-        Args:
-            segment (QgsGeometry): The segment to buffer.
-            reference_layer (QgsVectorLayer): The reference layer to check for intersections.
-            buffer_distance (float): The buffer distance.
-
-        Returns:
-            bool: True if the buffer intersects any features in the reference layer, False otherwise.
-        """
-        self.iface.messageBar().pushMessage(
-            "Info", "Starting analysis...", level=Qgis.Info
-        )
-
-        try:
-            # Create a buffer around the segment
-            segment_buffer = segment.buffer(
-                buffer_distance, 5
-            )  # 5 is the number of segments to approximate the buffer
-
-            # Create a spatial index for the reference layer
-            spatial_index = QgsSpatialIndex(reference_layer.getFeatures())
-
-            # Find features in the reference layer that intersect with the buffer's bounding box
-            candidate_ids = spatial_index.intersects(segment_buffer.boundingBox())
-
-            # Check for actual intersections with the candidate features
-            for feature_id in candidate_ids:
-                feature = reference_layer.getFeature(feature_id)
-                reference_geometry = feature.geometry()
-                if segment_buffer.intersects(reference_geometry):
-                    return True  # Intersection found
-
-            return False  # No intersection found
-
-        except Exception as e:
-            print(f"Error: {e}")
-            self.iface.messageBar().pushMessage("Error", str(e), level=Qgis.Critical)
-            return False
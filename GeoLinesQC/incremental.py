@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+
+from qgis.core import QgsFeature, QgsFeatureRequest, QgsProject
+
+# Custom property of an output layer holding the state of the run that filled it
+STATE_PROPERTY = "GeoLinesQC/state"
+
+
+def geometry_hash(geometry):
+    """
+    Returns a short hash of a geometry, to detect edited features.
+
+    Args:
+        geometry (QgsGeometry): The geometry.
+
+    Returns:
+        str: The hash, as hexadecimal.
+    """
+    return hashlib.blake2b(bytes(geometry.asWkb()), digest_size=8).hexdigest()
+
+
+def layer_fingerprint(layer):
+    """
+    Describes the content of a layer, to detect a changed reference.
+
+    Args:
+        layer (QgsVectorLayer): The layer.
+
+    Returns:
+        str: The source, filter, feature count, extent and, for files, the
+            modification time of the layer.
+    """
+    path = layer.source().split("|")[0]
+    modified = os.path.getmtime(path) if os.path.isfile(path) else None
+    return (
+        f"{layer.source()}|{layer.subsetString()}|{layer.featureCount()}|"
+        f"{layer.extent().toString()}|{modified}"
+    )
+
+
+def run_parameters(
+    input_layer,
+    reference_layer,
+    buffer_distance,
+    segment_length,
+    method,
+    max_distance=None,
+    mask=None,
+):
+    """
+    Returns the parameters a run's output depends on, besides the input geometries.
+
+    Args:
+        input_layer (QgsVectorLayer): The checked layer.
+        reference_layer (QgsVectorLayer): The reference layer.
+        buffer_distance (float or list): The buffer distance(s).
+        segment_length (float): The desired length of each segment.
+        method (str): The proximity test.
+        max_distance (float): Optional, the largest distance reported.
+        mask (RegionMask): Optional, the region the layers are clipped with.
+
+    Returns:
+        dict: The parameters, JSON serializable.
+    """
+    return {
+        "input": input_layer.id(),
+        "reference": layer_fingerprint(reference_layer),
+        "buffer_distance": buffer_distance,
+        "segment_length": segment_length,
+        "method": method,
+        "max_distance": max_distance,
+        "region": geometry_hash(mask.geometry) if mask is not None else None,
+    }
+
+
+def changed_features(features, previous_hashes, hashes):
+    """
+    Filters the features whose geometry changed since the previous run.
+
+    Args:
+        features (iterable): The QgsFeatures to filter.
+        previous_hashes (dict): Geometry hashes of the previous run, by feature id.
+        hashes (dict): Filled with the geometry hashes of all the features.
+
+    Yields:
+        QgsFeature: The new and edited features.
+    """
+    for feature in features:
+        key = str(feature.id())
+        hashes[key] = geometry_hash(feature.geometry())
+        if previous_hashes.get(key) != hashes[key]:
+            yield feature
+
+
+def save_state(layer, parameters, hashes):
+    """
+    Stores the parameters and geometry hashes of a run in its output layer.
+
+    Args:
+        layer (QgsVectorLayer): The output layer.
+        parameters (dict): See run_parameters.
+        hashes (dict): Geometry hashes of the checked features, by feature id.
+    """
+    layer.setCustomProperty(
+        STATE_PROPERTY, json.dumps({"parameters": parameters, "hashes": hashes})
+    )
+
+
+def find_previous_output(parameters):
+    """
+    Finds the output layer of a previous run with the same parameters.
+
+    Args:
+        parameters (dict): See run_parameters.
+
+    Returns:
+        tuple: The layer and the geometry hashes of its run, (None, None) if
+            no layer of the project matches.
+    """
+    # Compare as JSON, e.g. tuples are stored as lists
+    parameters = json.loads(json.dumps(parameters))
+    for layer in QgsProject.instance().mapLayers().values():
+        value = layer.customProperty(STATE_PROPERTY)
+        if not value:
+            continue
+        try:
+            state = json.loads(value)
+        except ValueError:
+            continue
+        if state.get("parameters") == parameters:
+            return layer, state.get("hashes", {})
+    return None, None
+
+
+def patch_output_layer(layer, stale_ids, features):
+    """
+    Replaces the segments of the edited features of an output layer.
+
+    The new segments are copied onto the fields of the layer by name, those
+    of a GeoPackage starting with its "fid" column.
+
+    Args:
+        layer (QgsVectorLayer): The output layer of the previous run.
+        stale_ids (iterable): Ids of the checked features whose segments are
+            removed, i.e. edited or deleted features.
+        features (iterable): The new segments.
+
+    Raises:
+        OSError: If the layer cannot be updated.
+    """
+    stale_ids = [int(fid) for fid in stale_ids]
+    provider = layer.dataProvider()
+    if stale_ids:
+        request = QgsFeatureRequest().setFilterExpression(
+            f'"id" IN ({", ".join(str(fid) for fid in stale_ids)})'
+        )
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        if not provider.deleteFeatures(
+            [feature.id() for feature in layer.getFeatures(request)]
+        ):
+            raise OSError(f"Cannot delete stale segments: {provider.lastError()}")
+
+    fields = layer.fields()
+    segments = []
+    for feature in features:
+        segment = QgsFeature(fields)
+        segment.setGeometry(feature.geometry())
+        for field in feature.fields():
+            if fields.indexFromName(field.name()) >= 0:
+                segment.setAttribute(field.name(), feature[field.name()])
+        segments.append(segment)
+    if segments and not provider.addFeatures(segments)[0]:
+        raise OSError(f"Cannot add the new segments: {provider.lastError()}")
+    layer.triggerRepaint()
@@ -0,0 +1,100 @@
+import logging
+import os
+from logging.handlers import MemoryHandler, RotatingFileHandler
+
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+
+from .utils import read_setting
+
+# Parent of the loggers of the plugin modules, logging.getLogger(__name__)
+LOGGER_NAME = "GeoLinesQC"
+
+LOG_FILE = "geolinesqc.log"
+DEFAULT_LOG_LEVEL = "INFO"
+
+# The file is rotated at this size, keeping this many older files
+LOG_MAX_BYTES = 1 << 20
+LOG_BACKUP_COUNT = 3
+
+# Number of records buffered before they are written, warnings are written at once
+LOG_BUFFER_SIZE = 200
+
+
+class MessageLogHandler(logging.Handler):
+    """Forwards log records to the GeoLinesQC tab of the QGIS message log."""
+
+    def emit(self, record):
+        if record.levelno >= logging.ERROR:
+            level = Qgis.Critical
+        elif record.levelno >= logging.WARNING:
+            level = Qgis.Warning
+        else:
+            level = Qgis.Info
+        try:
+            QgsMessageLog.logMessage(self.format(record), LOGGER_NAME, level=level)
+        except Exception:  # noqa: BLE001
+            # Like the logging handlers, never let a log record raise
+            self.handleError(record)
+
+
+def setup_logging():
+    """
+    Configures the plugin logger, replacing a previous configuration.
+
+    Records are sent to the QGIS message log and buffered in memory before
+    they are appended to a rotated file in the "logs" directory of the QGIS
+    profile, or in the directory set by the "log_dir" setting. The level is
+    read from the "log_level" setting, e.g. DEBUG to log every skipped feature.
+
+    Returns:
+        logging.Logger: The plugin logger.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    teardown_logging()
+
+    level = getattr(logging, read_setting("log_level", DEFAULT_LOG_LEVEL).upper(), None)
+    logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    logger.propagate = False
+    logger.addHandler(MessageLogHandler())
+
+    directory = read_setting(
+        "log_dir", os.path.join(QgsApplication.qgisSettingsDirPath(), "logs")
+    )
+    try:
+        os.makedirs(directory, exist_ok=True)
+        file_handler = RotatingFileHandler(
+            os.path.join(directory, LOG_FILE),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+    except OSError as e:
+        logger.warning("Cannot log to %s: %s", directory, e)
+        return logger
+
+    file_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    logger.addHandler(
+        MemoryHandler(LOG_BUFFER_SIZE, flushLevel=logging.WARNING, target=file_handler)
+    )
+    return logger
+
+
+def flush_logs():
+    """Writes the buffered records, e.g. at the end of a run."""
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        handler.flush()
+
+
+def teardown_logging():
+    """Writes the buffered records and removes the handlers of the plugin logger."""
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        target = getattr(handler, "target", None)
+        # Closing a memory handler flushes it, but leaves its target open
+        handler.close()
+        if target is not None:
+            target.close()
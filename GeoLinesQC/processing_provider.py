@@ -0,0 +1,262 @@
+import os
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingFeatureSourceDefinition,
+    QgsProcessingParameterDistance,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingProvider,
+    QgsWkbTypes,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from .analysis import METHOD_LABELS, masked_features, output_fields, run_analysis
+from .engine import DEFAULT_BUFFER, DEFAULT_SEGMENT_LENGTH, METHODS, search_distance
+from .reference import (
+    build_reference_index,
+    check_reference_crs,
+    reference_cache_key,
+    reference_request,
+)
+from .stats import RunStats
+from .utils import ClipError, RegionMask
+
+
+class GeolinesQCProvider(QgsProcessingProvider):
+    """Processing provider exposing the GeoLines QC algorithm."""
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(GeolinesQCAlgorithm())
+
+    def id(self):
+        return "geolinesqc"
+
+    def name(self):
+        return "GeoLines QC"
+
+    def icon(self):
+        return QIcon(
+            os.path.join(os.path.dirname(__file__), "icons8-line-chart-50.png")
+        )
+
+
+class GeolinesQCAlgorithm(QgsProcessingAlgorithm):
+    """
+    Splits the lines of a layer into segments and flags the segments within
+    a buffer distance of a reference layer, like the plugin dialog does.
+    """
+
+    INPUT = "INPUT"
+    REFERENCE = "REFERENCE"
+    OVERLAY = "OVERLAY"
+    BUFFER = "BUFFER"
+    SEGMENT_LENGTH = "SEGMENT_LENGTH"
+    METHOD = "METHOD"
+    MAX_DISTANCE = "MAX_DISTANCE"
+    OUTPUT = "OUTPUT"
+
+    # Describes the reference layer for the index cache, set by prepareAlgorithm
+    cache_key = None
+
+    def tr(self, message):
+        return QCoreApplication.translate("GeoLinesQC", message)
+
+    def createInstance(self):
+        return GeolinesQCAlgorithm()
+
+    def name(self):
+        return "geolinesqc"
+
+    def displayName(self):
+        return self.tr("GeoLines QC")
+
+    def shortHelpString(self):
+        return self.tr(
+            "Splits the lines of a layer into segments of equal length and checks "
+            "whether each segment is within the buffer distance of a line of the "
+            "reference layer. The result is stored in the 'intersects' field. "
+            "If a maximum distance is given, the distance to the nearest reference "
+            "line is stored in the 'distance' field, NULL above the maximum. "
+            "If a region layer is given, both layers are clipped with it."
+        )
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr("Layer to check"),
+                [QgsProcessing.TypeVectorLine],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.REFERENCE,
+                self.tr("Reference layer"),
+                [QgsProcessing.TypeVectorLine],
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.OVERLAY,
+                self.tr("Region layer"),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                self.BUFFER,
+                self.tr("Buffer distance"),
+                DEFAULT_BUFFER,
+                self.INPUT,
+                minValue=0.0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                self.SEGMENT_LENGTH,
+                self.tr("Segment length"),
+                DEFAULT_SEGMENT_LENGTH,
+                self.INPUT,
+                minValue=0.0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METHOD,
+                self.tr("Proximity test"),
+                [METHOD_LABELS[method] for method in METHODS],
+                defaultValue=0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterDistance(
+                self.MAX_DISTANCE,
+                self.tr("Store distances up to"),
+                None,
+                self.INPUT,
+                optional=True,
+                minValue=0.0,
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr("Checked segments"),
+                QgsProcessing.TypeVectorLine,
+            )
+        )
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        # Layers can only be read on the main thread, processAlgorithm may run
+        # in a background thread
+        self.cache_key = None
+        definition = parameters.get(self.REFERENCE)
+        if isinstance(definition, QgsProcessingFeatureSourceDefinition) and (
+            definition.selectedFeaturesOnly
+            or definition.featureLimit >= 0
+            or getattr(definition, "filterExpression", "")
+        ):
+            # Only whole layers are cached
+            return True
+        reference_layer = self.parameterAsVectorLayer(
+            parameters, self.REFERENCE, context
+        )
+        if reference_layer is not None:
+            self.cache_key = reference_cache_key(reference_layer)
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        buffer_distance = self.parameterAsDouble(parameters, self.BUFFER, context)
+        segment_length = self.parameterAsDouble(
+            parameters, self.SEGMENT_LENGTH, context
+        )
+        method = METHODS[self.parameterAsEnum(parameters, self.METHOD, context)]
+        max_distance = None
+        if parameters.get(self.MAX_DISTANCE) is not None:
+            max_distance = self.parameterAsDouble(
+                parameters, self.MAX_DISTANCE, context
+            )
+
+        input_source = self.parameterAsSource(parameters, self.INPUT, context)
+        reference_source = self.parameterAsSource(parameters, self.REFERENCE, context)
+        if input_source is None:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, self.INPUT)
+            )
+        if reference_source is None:
+            raise QgsProcessingException(
+                self.invalidSourceError(parameters, self.REFERENCE)
+            )
+        try:
+            check_reference_crs(input_source.sourceCrs(), reference_source.sourceCrs())
+        except ValueError as e:
+            raise QgsProcessingException(str(e)) from e
+
+        # Both layers are clipped with the region while they are read
+        overlay_source = self.parameterAsSource(parameters, self.OVERLAY, context)
+        stats = RunStats()
+        mask = None
+        if overlay_source is not None:
+            try:
+                with stats.stage("clip"):
+                    mask = RegionMask.from_layer(
+                        overlay_source,
+                        input_source.sourceCrs(),
+                        context.transformContext(),
+                    )
+            except ClipError as e:
+                raise QgsProcessingException(str(e)) from e
+
+        fields = output_fields(max_distance is not None)
+        sink, dest_id = self.parameterAsSink(
+            parameters,
+            self.OUTPUT,
+            context,
+            fields,
+            QgsWkbTypes.LineString,
+            input_source.sourceCrs(),
+        )
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        try:
+            feedback.pushInfo(self.tr("Indexing the reference layer..."))
+            with stats.stage("index"):
+                reference_index = build_reference_index(
+                    reference_source,
+                    method,
+                    reference_request(
+                        input_source.sourceExtent(),
+                        search_distance(buffer_distance, max_distance),
+                        mask,
+                    ),
+                    mask,
+                    cache_key=self.cache_key,
+                )
+
+            features, segments, intersecting = run_analysis(
+                masked_features(input_source, mask),
+                reference_index,
+                sink,
+                fields,
+                buffer_distance,
+                segment_length,
+                feature_count=input_source.featureCount(),
+                feedback=feedback,
+                max_distance=max_distance,
+                stats=stats,
+            )
+        except ClipError as e:
+            raise QgsProcessingException(str(e)) from e
+        feedback.pushInfo(
+            f"{features} features, {segments} segments, {intersecting} intersecting"
+        )
+        feedback.pushInfo(stats.summary())
+
+        return {self.OUTPUT: dest_id}
@@ -0,0 +1,215 @@
+"""Profilers of a run, to send a profile of a slow sheet rather than a report.
+
+Two profilers are available, both profiling the thread they are started in:
+
+- cProfile, deterministic, saved as a ``.prof`` file readable with pstats or
+  snakeviz, and importable in speedscope once converted;
+- a sampling profiler, with a lower overhead on NumPy heavy code, saved in
+  the speedscope JSON format (https://www.speedscope.app).
+
+Worker processes of a parallel run are not profiled. Like the engine, this
+module does not import anything from ``qgis``.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILER_CPROFILE = "cprofile"
+PROFILER_SAMPLING = "sampling"
+PROFILERS = (PROFILER_CPROFILE, PROFILER_SAMPLING)
+
+# Time between two samples of the sampling profiler [s]
+DEFAULT_SAMPLING_INTERVAL = 0.005
+
+# Number of functions listed in the summary of a profile
+DEFAULT_TOP_COUNT = 10
+
+
+def create_profiler(kind):
+    """
+    Creates a profiler.
+
+    Args:
+        kind (str): PROFILER_CPROFILE or PROFILER_SAMPLING.
+
+    Returns:
+        CProfiler or SamplingProfiler: The profiler, not started yet.
+
+    Raises:
+        ValueError: If the kind of profiler is unknown.
+    """
+    if kind == PROFILER_CPROFILE:
+        return CProfiler()
+    if kind == PROFILER_SAMPLING:
+        return SamplingProfiler()
+    raise ValueError(f"Unknown profiler: {kind}, expected one of {PROFILERS}")
+
+
+def _describe(name, path, line, seconds, total):
+    share = 100.0 * seconds / total if total else 0.0
+    return f"{seconds:8.3f} s {share:5.1f}%  {name} ({os.path.basename(path)}:{line})"
+
+
+class CProfiler:
+    """Deterministic profiler of the calling thread, based on cProfile."""
+
+    extension = ".prof"
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+
+    def save(self, path):
+        """
+        Saves the profile in the pstats format.
+
+        Args:
+            path (str): Path of the file, without extension.
+
+        Returns:
+            str: Path of the written file.
+        """
+        path += self.extension
+        self.profile.dump_stats(path)
+        return path
+
+    def top_functions(self, count=DEFAULT_TOP_COUNT):
+        """
+        Lists the functions the most time was spent in, excluding callees.
+
+        Args:
+            count (int): Number of functions listed.
+
+        Returns:
+            list: One line per function, hottest first.
+        """
+        stats = pstats.Stats(self.profile).stats
+        total = sum(own_time for _calls, _count, own_time, _cum, _by in stats.values())
+        hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+        return [
+            _describe(name, path, line, own_time, total)
+            for (path, line, name), (_c, _n, own_time, _cum, _by) in hottest[:count]
+        ]
+
+
+class SamplingProfiler:
+    """
+    Sampling profiler of the calling thread.
+
+    A background thread records the call stack of the profiled thread every
+    interval, so the profiled code runs unchanged.
+    """
+
+    extension = ".speedscope.json"
+
+    def __init__(self, interval=DEFAULT_SAMPLING_INTERVAL):
+        """
+        Args:
+            interval (float): Time between two samples [s].
+        """
+        self.interval = interval
+        self.frames = {}
+        self.stacks = {}
+        self.duration = 0.0
+        self._started = 0.0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        self._stopped.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stopped.set()
+        self._thread.join()
+        self.duration += time.perf_counter() - self._started
+
+    def _sample(self, thread_id):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_name, code.co_filename, code.co_firstlineno)
+                stack.append(self.frames.setdefault(key, len(self.frames)))
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def save(self, path):
+        """
+        Saves the samples in the speedscope format.
+
+        Args:
+            path (str): Path of the file, without extension.
+
+        Returns:
+            str: Path of the written file.
+        """
+        path += self.extension
+        frames = sorted(self.frames, key=self.frames.get)
+        data = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "GeoLinesQC",
+            "name": os.path.basename(path),
+            "shared": {
+                "frames": [
+                    {"name": name, "file": file, "line": line}
+                    for name, file, line in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": "GeoLines QC",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": [list(stack) for stack in self.stacks],
+                    "weights": [
+                        count * self.interval for count in self.stacks.values()
+                    ],
+                }
+            ],
+        }
+        with open(path, "w") as f:
+            json.dump(data, f)
+        return path
+
+    def top_functions(self, count=DEFAULT_TOP_COUNT):
+        """
+        Lists the functions the most samples were taken in, excluding callees.
+
+        Args:
+            count (int): Number of functions listed.
+
+        Returns:
+            list: One line per function, hottest first.
+        """
+        own = {}
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + samples
+        frames = sorted(self.frames, key=self.frames.get)
+        total = sum(own.values()) * self.interval
+        hottest = sorted(own.items(), key=lambda item: item[1], reverse=True)
+        return [
+            _describe(*frames[frame], samples * self.interval, total)
+            for frame, samples in hottest[:count]
+        ]
@@ -0,0 +1,504 @@
+import hashlib
+import os
+import shutil
+from collections import OrderedDict
+
+from qgis.core import (
+    Qgis,
+    QgsApplication,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsMessageLog,
+    QgsSpatialIndex,
+)
+
+from .engine import (
+    DEFAULT_REFERENCE_CHUNK_LENGTH,
+    INDEX_GRID,
+    INDEX_RTREE,
+    METHOD_DISTANCE,
+    GridIndex,
+    ReferenceIndex,
+    segment_line,
+)
+from .incremental import geometry_hash, layer_fingerprint
+from .utils import coords_to_geometry, geometry_to_parts, read_setting
+
+# Number of prepared reference geometries kept in memory at once
+DEFAULT_PREPARED_CACHE_SIZE = 10000
+
+# Changed whenever the layout of the cached reference indexes changes
+CACHE_VERSION = 1
+
+# The cache indexes the whole reference: below this share of the reference
+# extent around the checked layer, only the features around it are read
+DEFAULT_CACHE_MIN_SHARE = 0.25
+
+
+def build_reference_index(
+    reference_layer,
+    method,
+    request=None,
+    mask=None,
+    chunk_length=None,
+    index=None,
+    cache_key=None,
+):
+    """
+    Builds the reference index matching a proximity test.
+
+    With a cache_key, the exact distance index of the whole reference is
+    cached on disk and memory-mapped back on later runs, see
+    reference_cache_key; the request is then ignored. The cache is skipped
+    when the request covers less than the "reference_cache_min_share" of the
+    reference extent, e.g. a small sheet checked against a national reference.
+
+    Args:
+        reference_layer (QgsVectorLayer or QgsFeatureSource): The reference to index.
+        method (str): METHOD_BUFFER or METHOD_DISTANCE.
+        request (QgsFeatureRequest): Optional, restricts the reference features
+            read, see reference_request.
+        mask (RegionMask): Optional, clips the reference features while they
+            are read.
+        chunk_length (float): Length of the indexed reference pieces, read
+            from the "reference_chunk_length" setting by default.
+        index (str): INDEX_RTREE or INDEX_GRID, read from the "index" setting
+            by default.
+        cache_key (str): Optional, describes the reference layer for the cache.
+
+    Returns:
+        LayerReferenceIndex or ReferenceIndex: The index, to be passed to the engine.
+    """
+    if chunk_length is None:
+        chunk_length = read_setting(
+            "reference_chunk_length", DEFAULT_REFERENCE_CHUNK_LENGTH, float
+        )
+    if index is None:
+        index = read_setting("index", INDEX_RTREE)
+
+    min_share = read_setting(
+        "reference_cache_min_share", DEFAULT_CACHE_MIN_SHARE, float
+    )
+    if (
+        method == METHOD_DISTANCE
+        and cache_key is not None
+        and request_share(reference_layer, request) >= min_share
+    ):
+        return cached_reference_index(
+            reference_layer, cache_key, mask, chunk_length, index
+        )
+
+    features = reference_layer.getFeatures(request or QgsFeatureRequest())
+    if mask is not None:
+        features = mask.features(features)
+
+    if method == METHOD_DISTANCE:
+        return ReferenceIndex(features_to_parts(features), chunk_length, index)
+    return LayerReferenceIndex(features, chunk_length=chunk_length, index=index)
+
+
+def request_share(reference_layer, request):
+    """
+    Estimates the share of a reference read by a request, from its extent.
+
+    Args:
+        reference_layer (QgsVectorLayer or QgsFeatureSource): The reference.
+        request (QgsFeatureRequest): The request, see reference_request.
+
+    Returns:
+        float: The area of the filter rectangle within the reference extent,
+            relative to the area of the extent. 1 without filter rectangle.
+    """
+    if request is None or request.filterRect().isNull():
+        return 1.0
+    extent = reference_layer.sourceExtent()
+    area = extent.width() * extent.height()
+    if area <= 0:
+        return 1.0
+    covered = extent.intersect(request.filterRect())
+    return covered.width() * covered.height() / area
+
+
+def reference_cache_key(reference_layer):
+    """
+    Describes a reference layer for the on-disk cache of reference indexes.
+
+    Must be called on the main thread, with the layer itself.
+
+    Args:
+        reference_layer (QgsVectorLayer): The reference layer.
+
+    Returns:
+        str: The source of the layer on the first line, then its
+            modification time, feature count and CRS, among others. None if the layer is not a file, has unsaved
+            edits, which are read with its features but not in the file, or
+            the cache is disabled by the "reference_cache" setting.
+    """
+    if not read_setting("reference_cache", True, bool):
+        return None
+    if reference_layer.isModified():
+        return None
+    if not os.path.isfile(reference_layer.source().split("|")[0]):
+        return None
+    return "\n".join(
+        (
+            reference_layer.source(),
+            layer_fingerprint(reference_layer),
+            reference_layer.crs().authid(),
+        )
+    )
+
+
+def cached_reference_index(reference_layer, cache_key, mask, chunk_length, index):
+    """
+    Loads an exact distance reference index from the cache, building and
+    saving it on the first use.
+
+    The whole reference is indexed, so that the cached index serves any
+    checked layer. It is saved in a temporary directory first, renamed once
+    complete. A layer has a single cached index: the one saved replaces
+    those of older versions of the file or of other parameters.
+
+    Args:
+        reference_layer (QgsVectorLayer or QgsFeatureSource): The reference to index.
+        cache_key (str): Describes the reference layer, see reference_cache_key.
+        mask (RegionMask): Optional, clips the reference features.
+        chunk_length (float): Length of the indexed reference pieces.
+        index (str): INDEX_RTREE or INDEX_GRID.
+
+    Returns:
+        ReferenceIndex: The index.
+    """
+    region = geometry_hash(mask.geometry) if mask is not None else None
+    source = hashlib.blake2b(
+        cache_key.split("\n", 1)[0].encode(), digest_size=8
+    ).hexdigest()
+    variant = hashlib.blake2b(
+        f"{cache_key}|{region}|{chunk_length}|{index}|{CACHE_VERSION}".encode(),
+        digest_size=16,
+    ).hexdigest()
+    name = f"{source}-{variant}"
+    cache_dir = read_setting(
+        "reference_cache_dir",
+        os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "GeoLinesQC"),
+    )
+    directory = os.path.join(cache_dir, name)
+
+    if os.path.isdir(directory):
+        try:
+            reference = ReferenceIndex.load(directory)
+            QgsMessageLog.logMessage(
+                f"Reference index loaded from {directory}",
+                "GeoLinesQC",
+                level=Qgis.Info,
+            )
+            return reference
+        except (OSError, ValueError) as e:
+            QgsMessageLog.logMessage(
+                f"Rebuilding the reference index, cannot load {directory}: {e}",
+                "GeoLinesQC",
+                level=Qgis.Warning,
+            )
+            shutil.rmtree(directory, ignore_errors=True)
+
+    features = reference_layer.getFeatures(
+        QgsFeatureRequest().setSubsetOfAttributes([])
+    )
+    if mask is not None:
+        features = mask.features(features)
+    reference = ReferenceIndex(features_to_parts(features), chunk_length, index)
+
+    temporary = f"{directory}.{os.getpid()}.tmp"
+    try:
+        reference.save(temporary)
+        os.replace(temporary, directory)
+        evict_cached_indexes(cache_dir, source, keep=name)
+    except OSError as e:
+        # E.g. another run saved the same index meanwhile
+        QgsMessageLog.logMessage(
+            f"Cannot cache the reference index in {directory}: {e}",
+            "GeoLinesQC",
+            level=Qgis.Warning,
+        )
+        shutil.rmtree(temporary, ignore_errors=True)
+    return reference
+
+
+def evict_cached_indexes(cache_dir, source, keep):
+    """
+    Removes the cached indexes of a reference layer, but one.
+
+    Args:
+        cache_dir (str): The cache directory.
+        source (str): Hash of the layer source, prefix of its index directories.
+        keep (str): Name of the index directory kept.
+    """
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        # Temporary directories may be written by another run
+        if name == keep or not name.startswith(f"{source}-") or name.endswith(".tmp"):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        QgsMessageLog.logMessage(
+            f"Removed the stale reference index {path}", "GeoLinesQC", level=Qgis.Info
+        )
+
+
+def check_reference_crs(input_crs, reference_crs):
+    """
+    Checks that the checked and the reference layers share their CRS.
+
+    Distances are measured on the coordinates of both layers as they are,
+    and the reference is read within the extent of the checked layer, so
+    layers in different CRSs would silently match nothing.
+
+    Args:
+        input_crs (QgsCoordinateReferenceSystem): CRS of the checked layer.
+        reference_crs (QgsCoordinateReferenceSystem): CRS of the reference layer.
+
+    Raises:
+        ValueError: If the CRSs differ.
+    """
+    if input_crs != reference_crs:
+        raise ValueError(
+            f"The reference layer ({reference_crs.authid()}) and the checked layer "
+            f"({input_crs.authid()}) must be in the same CRS, reproject one of them"
+        )
+
+
+def reference_request(input_extent, buffer_distance, mask=None):
+    """
+    Builds a request reading only the reference features that can be within
+    buffer_distance of the checked layer.
+
+    The filter rectangle is passed down to the data provider, which uses its
+    own spatial index: a small map sheet checked against a national reference
+    only reads the reference features around it. No attribute is read.
+
+    Args:
+        input_extent (QgsRectangle): Extent of the checked layer, which is in
+            the CRS of the reference layer, see check_reference_crs.
+        buffer_distance (float): The buffer distance.
+        mask (RegionMask): Optional, the checked layer is restricted to it.
+
+    Returns:
+        QgsFeatureRequest: The request.
+    """
+    if mask is not None:
+        input_extent = input_extent.intersect(mask.extent)
+
+    request = QgsFeatureRequest()
+    request.setFilterRect(input_extent.buffered(buffer_distance))
+    request.setSubsetOfAttributes([])
+    return request
+
+
+def features_to_parts(features):
+    """
+    Reads the line parts of features.
+
+    Features without geometry or with a non-line geometry are skipped.
+
+    Args:
+        features (iterable): The QgsFeatures to read.
+
+    Returns:
+        list: A list of (n, 2) arrays.
+    """
+    parts = []
+    for feature in features:
+        if not feature.hasGeometry():
+            continue
+        try:
+            parts.extend(geometry_to_parts(feature.geometry()))
+        except ValueError:
+            continue
+    return parts
+
+
+class LayerReferenceIndex:
+    """
+    Spatial index over the features of a reference layer.
+
+    The index and the reference geometries are read once, when the object is
+    created, and then shared by every segment checked during a run. Segments
+    are tested with a GEOS buffer polygon, like the plugin always did; it can
+    be passed to the engine wherever a reference is expected.
+
+    Reference lines are indexed as pieces of chunk_length, keyed by their
+    position in the index rather than by feature id, so that the bounding box
+    of a long line does not make it a candidate for every segment. A piece is
+    typically a candidate for many neighbouring segments, so the GEOS engine
+    of each candidate is prepared on first use and kept in a least recently
+    used cache.
+
+    The pieces are found with a QgsSpatialIndex, or with the engine's
+    GridIndex, built on the first query since it is sized for the buffer.
+
+    If stats is set to a RunStats, the candidate pieces and the pieces
+    tested with GEOS are counted in it.
+    """
+
+    stats = None
+
+    def __init__(
+        self,
+        features,
+        cache_size=None,
+        chunk_length=DEFAULT_REFERENCE_CHUNK_LENGTH,
+        index=INDEX_RTREE,
+    ):
+        """
+        Args:
+            features (iterable): The reference QgsFeatures to index.
+            cache_size (int): Maximum number of prepared geometries kept, read
+                from the "prepared_cache_size" setting by default.
+            chunk_length (float): Length of the indexed pieces, 0 to index
+                whole lines.
+            index (str): INDEX_RTREE or INDEX_GRID.
+        """
+        if cache_size is None:
+            cache_size = read_setting(
+                "prepared_cache_size", DEFAULT_PREPARED_CACHE_SIZE, int
+            )
+        self.cache_size = max(1, cache_size)
+        self.prepared = OrderedDict()
+        self.index = index
+        self.spatial_index = QgsSpatialIndex()
+        self.bounds = []
+        self.grid = None
+        self.geometries = {}
+
+        for feature in features:
+            if not feature.hasGeometry():
+                continue
+            geometry = feature.geometry()
+            try:
+                pieces = [
+                    coords_to_geometry(coords)
+                    for coords in segment_line(
+                        geometry_to_parts(geometry), chunk_length
+                    )
+                ]
+            except ValueError:
+                # Not a line, indexed as a whole
+                pieces = [geometry]
+            for piece in pieces:
+                self.add_geometry(piece)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def add_geometry(self, geometry):
+        """
+        Adds a reference geometry to the index.
+
+        Args:
+            geometry (QgsGeometry): The geometry to add.
+        """
+        piece_id = len(self.geometries)
+        box = geometry.boundingBox()
+        if self.index == INDEX_GRID:
+            self.bounds.append(
+                (box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum())
+            )
+        else:
+            self.spatial_index.addFeature(piece_id, box)
+        self.geometries[piece_id] = geometry
+
+    def candidates(self, box, buffer_distance):
+        """
+        Finds the pieces whose bounding box intersects a rectangle.
+
+        Args:
+            box (QgsRectangle): The rectangle.
+            buffer_distance (float): The buffer distance of the run.
+
+        Returns:
+            list: The ids of the pieces.
+        """
+        if self.index != INDEX_GRID:
+            candidate_ids = self.spatial_index.intersects(box)
+        else:
+            if self.grid is None or self.grid.cell_size < buffer_distance:
+                self.grid = GridIndex.for_buffer(self.bounds, buffer_distance)
+            candidate_ids = self.grid.query(
+                box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()
+            ).tolist()
+
+        if self.stats is not None:
+            self.stats.count("candidates", len(candidate_ids))
+        return candidate_ids
+
+    def prepared_engine(self, piece_id):
+        """
+        Returns the prepared GEOS engine of an indexed reference geometry.
+
+        Args:
+            piece_id (int): Id of the geometry in the index.
+
+        Returns:
+            QgsGeometryEngine: The prepared engine.
+        """
+        engine = self.prepared.get(piece_id)
+        if engine is not None:
+            self.prepared.move_to_end(piece_id)
+            return engine
+
+        engine = QgsGeometry.createGeometryEngine(self.geometries[piece_id].constGet())
+        engine.prepareGeometry()
+        self.prepared[piece_id] = engine
+        if len(self.prepared) > self.cache_size:
+            self.prepared.popitem(last=False)
+        return engine
+
+    def intersects(self, coords, buffer_distance):
+        """
+        Buffers a segment and checks if it intersects with any indexed reference geometry.
+
+        Args:
+            coords (ndarray): The (n, 2) vertex coordinates of the segment to buffer.
+            buffer_distance (float): The buffer distance.
+
+        Returns:
+            bool: True if the buffer intersects any reference geometry, False otherwise.
+        """
+        # 5 is the number of segments to approximate a quarter circle
+        segment_buffer = coords_to_geometry(coords).buffer(buffer_distance, 5)
+
+        # Find pieces whose bounding box intersects the buffer's bounding box
+        candidate_ids = self.candidates(segment_buffer.boundingBox(), buffer_distance)
+
+        # Check for actual intersections with the prepared candidate geometries
+        buffer_geometry = segment_buffer.constGet()
+        for piece_id in candidate_ids:
+            if self.stats is not None:
+                self.stats.count("exact_tests")
+            if self.prepared_engine(piece_id).intersects(buffer_geometry):
+                return True
+
+        return False
+
+    def distance(self, coords, max_distance):
+        """
+        Computes the distance from a segment to the nearest reference geometry.
+
+        Args:
+            coords (ndarray): The (n, 2) vertex coordinates of the segment.
+            max_distance (float): Distances above this one are not computed.
+
+        Returns:
+            float: The distance, None if it is above max_distance.
+        """
+        segment = coords_to_geometry(coords)
+        box = segment.boundingBox().buffered(max_distance)
+
+        best = None
+        for piece_id in self.candidates(box, max_distance):
+            if self.stats is not None:
+                self.stats.count("exact_tests")
+            distance = self.prepared_engine(piece_id).distance(segment.constGet())
+            if best is None or distance < best:
+                best = distance
+
+        return best if best is not None and best <= max_distance else None
@@ -0,0 +1,150 @@
+"""Timings and counters of a run, to tell where a slow run spends its time.
+
+Like the engine, this module does not import anything from ``qgis``.
+"""
+
+import json
+import time
+from contextlib import contextmanager
+
+# Stages in the order of a run, others are reported after them
+STAGES = (
+    "clip",
+    "index",
+    "load",
+    "segmentation",
+    "proximity",
+    "write",
+    "styling",
+)
+
+
+class RunStats:
+    """
+    Wall time spent in every stage of a run and counters, e.g. of segments.
+
+    Stages do not overlap: reading the reference is part of "index", reading
+    and clipping the checked features is "load". With several processes, the
+    segmentation and proximity times are summed over the processes and can
+    exceed the elapsed time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.counters = {}
+
+    def add_time(self, stage, seconds):
+        """
+        Adds time spent in a stage.
+
+        Args:
+            stage (str): Name of the stage, e.g. "proximity".
+            seconds (float): The wall time.
+        """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Measures the time spent in a with block.
+
+        Args:
+            stage (str): Name of the stage the time is added to.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def timed(self, iterable, stage):
+        """
+        Measures the time spent producing the items of an iterable.
+
+        Args:
+            iterable (iterable): The items, e.g. features read from a layer.
+            stage (str): Name of the stage the time is added to.
+
+        Yields:
+            The items of the iterable.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def count(self, counter, value=1):
+        """
+        Increments a counter.
+
+        Args:
+            counter (str): Name of the counter, e.g. "candidates".
+            value (int): The increment.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + int(value)
+
+    def merge(self, data):
+        """
+        Adds the timings and counters of another run, e.g. of a worker process.
+
+        Args:
+            data (dict): See as_dict.
+        """
+        for stage, seconds in data.get("timings", {}).items():
+            self.add_time(stage, seconds)
+        for counter, value in data.get("counters", {}).items():
+            self.count(counter, value)
+
+    def as_dict(self):
+        """
+        Returns the statistics, JSON serializable.
+
+        Returns:
+            dict: The "timings" [s] by stage, the "counters" and the time
+                "elapsed" [s] since the statistics were created.
+        """
+        order = {stage: position for position, stage in enumerate(STAGES)}
+        return {
+            "elapsed": time.perf_counter() - self.started,
+            "timings": dict(
+                sorted(
+                    self.timings.items(),
+                    key=lambda item: order.get(item[0], len(order)),
+                )
+            ),
+            "counters": dict(self.counters),
+        }
+
+    def summary(self):
+        """
+        Describes the statistics on one line, for logs.
+
+        Returns:
+            str: The stage timings, elapsed time and counters.
+        """
+        data = self.as_dict()
+        timings = ", ".join(
+            f"{stage} {seconds:.2f} s" for stage, seconds in data["timings"].items()
+        )
+        counters = ", ".join(
+            f"{counter} {value}" for counter, value in data["counters"].items()
+        )
+        return f"{timings} (elapsed {data['elapsed']:.2f} s) | {counters}"
+
+    def write_json(self, path, **extra):
+        """
+        Writes the statistics to a JSON report.
+
+        Args:
+            path (str): Path of the file, overwritten.
+            **extra: Added to the report, e.g. the parameters of the run.
+        """
+        with open(path, "w") as f:
+            json.dump({**extra, **self.as_dict()}, f, indent=2)
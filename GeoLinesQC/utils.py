@@ -1,4 +1,29 @@
-from qgis.core import QgsFeature, QgsProject, QgsVectorLayer
+import time
+
+from qgis.core import (
+    Qgis,
+    QgsCoordinateTransform,
+    QgsCsException,
+    QgsFeature,
+    QgsFeatureRequest,
+    QgsGeometry,
+    QgsMessageLog,
+    QgsPointXY,
+    QgsProject,
+    QgsSettings,
+    QgsVectorLayer,
+    QgsWkbTypes,
+)
+
+from .engine import parts_from_wkb
+
+SETTINGS_GROUP = "GeoLinesQC"
+
+
+class ClipError(Exception):
+    """Custom exception for clipping operations"""
+
+    pass
 
 
 def geometry_to_vector_layer(geometry, layer_name="Region", crs="EPSG:2056"):
@@ -52,3 +77,222 @@ def get_layer_toc_name(layer):
     else:
         # If the layer is not in the TOC, return the layer's name
         return layer.name()
+
+
+def geometry_to_parts(geometry):
+    """
+    Converts a line QgsGeometry to the coordinate arrays used by the engine.
+
+    Args:
+        geometry (QgsGeometry): A (Multi)LineString, curved lines are segmentized.
+
+    Returns:
+        list: A list of (n, 2) arrays, one per part with vertices.
+
+    Raises:
+        ValueError: If the geometry is null, empty or not a line geometry.
+    """
+    if geometry.isNull() or geometry.isEmpty():
+        raise ValueError("Empty geometry")
+    if QgsWkbTypes.isCurvedType(geometry.wkbType()):
+        geometry = QgsGeometry(geometry.constGet().segmentize())
+
+    return [part for part in parts_from_wkb(bytes(geometry.asWkb())) if len(part)]
+
+
+def coords_to_geometry(coords):
+    """
+    Converts a (n, 2) coordinate array from the engine to a LineString QgsGeometry.
+
+    Args:
+        coords (ndarray): The vertex coordinates.
+
+    Returns:
+        QgsGeometry: The line geometry.
+    """
+    return QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in coords])
+
+
+def read_setting(key, default, value_type=str):
+    """
+    Reads a plugin setting from the QGIS user profile.
+
+    Settings are stored under the "GeoLinesQC" group and can be edited in
+    Settings -> Options -> Advanced.
+
+    Args:
+        key (str): Name of the setting, without the group.
+        default: Value returned when the setting is not set.
+        value_type (type): Type the value is converted to.
+
+    Returns:
+        The value of the setting.
+    """
+    return QgsSettings().value(f"{SETTINGS_GROUP}/{key}", default, type=value_type)
+
+
+class RateLimiter:
+    """
+    Lets an action through at most once per interval, e.g. the progress
+    updates of a loop over thousands of features.
+    """
+
+    def __init__(self, rate):
+        """
+        Args:
+            rate (float): Maximum number of actions per second, 0 for no limit.
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.last = None
+
+    def ready(self):
+        """
+        Checks if the action may run now, and if so starts a new interval.
+
+        Returns:
+            bool: True on the first call and once the interval has elapsed.
+        """
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.interval:
+            return False
+        self.last = now
+        return True
+
+
+class RegionMask:
+    """
+    Region polygons unioned and prepared once, to clip features on the fly.
+
+    Features are clipped while they are streamed into the analysis, so no
+    clipped copy of the checked or reference layer is ever created. The
+    region is transformed to the CRS of the clipped layers when the mask is
+    created, both layers sharing their CRS.
+    """
+
+    def __init__(self, geometries):
+        """
+        Args:
+            geometries (iterable): The region QgsGeometries.
+
+        Raises:
+            ClipError: If the region is empty.
+        """
+        self.geometry = QgsGeometry.unaryUnion(
+            [geometry for geometry in geometries if not geometry.isNull()]
+        )
+        if self.geometry.isNull() or self.geometry.isEmpty():
+            raise ClipError("The region layer contains no geometry")
+
+        self.extent = self.geometry.boundingBox()
+        self.engine = QgsGeometry.createGeometryEngine(self.geometry.constGet())
+        self.engine.prepareGeometry()
+
+    @classmethod
+    def from_layer(cls, region_layer, crs=None, transform_context=None):
+        """
+        Creates the mask from the selected features of region_layer, or from
+        the whole layer if nothing is selected.
+
+        Args:
+            region_layer (QgsVectorLayer or QgsFeatureSource): The region layer.
+            crs (QgsCoordinateReferenceSystem): Optional, CRS of the clipped
+                layers, the region is transformed to it.
+            transform_context (QgsCoordinateTransformContext): Optional, the
+                context of the transformation, the project's by default.
+
+        Returns:
+            RegionMask: The mask.
+
+        Raises:
+            ClipError: If the region is empty or cannot be transformed.
+        """
+        if getattr(region_layer, "selectedFeatureCount", lambda: 0)() > 0:
+            QgsMessageLog.logMessage(
+                f"Using {region_layer.selectedFeatureCount()} selected features for clipping",
+                "GeoLinesQC",
+                level=Qgis.Info,
+            )
+            features = region_layer.getSelectedFeatures()
+        else:
+            features = region_layer.getFeatures()
+        geometries = [feature.geometry() for feature in features]
+
+        source_crs = region_layer.sourceCrs()
+        if (
+            crs is not None
+            and crs.isValid()
+            and source_crs.isValid()
+            and source_crs != crs
+        ):
+            transform = QgsCoordinateTransform(
+                source_crs,
+                crs,
+                transform_context or QgsProject.instance().transformContext(),
+            )
+            try:
+                for geometry in geometries:
+                    if not geometry.isNull() and geometry.transform(transform) != 0:
+                        raise QgsCsException("Transformation failed")
+            except QgsCsException as e:
+                raise ClipError(
+                    f"Cannot transform the region from {source_crs.authid()} "
+                    f"to {crs.authid()}: {e}"
+                ) from e
+        return cls(geometries)
+
+    def request(self):
+        """
+        Returns a request reading only the features around the region.
+
+        Returns:
+            QgsFeatureRequest: The request, filtered on the region's extent.
+        """
+        return QgsFeatureRequest().setFilterRect(self.extent)
+
+    def clip(self, geometry):
+        """
+        Clips a line geometry with the region.
+
+        Args:
+            geometry (QgsGeometry): The geometry to clip.
+
+        Returns:
+            QgsGeometry: The part of the geometry inside the region, None if
+                there is none.
+        """
+        if geometry.isNull() or not self.engine.intersects(geometry.constGet()):
+            return None
+        if self.engine.contains(geometry.constGet()):
+            return geometry
+
+        clipped = geometry.intersection(self.geometry)
+        if QgsWkbTypes.geometryType(clipped.wkbType()) != QgsWkbTypes.LineGeometry:
+            # Keep the lines of mixed collections, drop touching points
+            clipped = clipped.convertToType(QgsWkbTypes.LineGeometry, True)
+        if clipped is None or clipped.isNull() or clipped.isEmpty():
+            return None
+        return clipped
+
+    def features(self, features):
+        """
+        Clips features on the fly, dropping those outside of the region.
+
+        Args:
+            features (iterable): The QgsFeatures to clip.
+
+        Yields:
+            QgsFeature: The clipped features.
+
+        Raises:
+            ClipError: If no feature overlaps the region.
+        """
+        clipped = 0
+        for feature in features:
+            geometry = self.clip(feature.geometry())
+            if geometry is None:
+                continue
+            feature.setGeometry(geometry)
+            clipped += 1
+            yield feature
+        if not clipped:
+            raise ClipError("Clipping resulted in an empty layer")
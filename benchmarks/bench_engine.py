@@ -0,0 +1,263 @@
+"""Throughput benchmark of the segmentation and proximity engine.
+
+Generates reproducible synthetic reference and input line sets and reports,
+for each scenario, the time spent in every stage, as measured by the
+engine's RunStats, the segments checked per second of proximity test and
+the peak memory of the process (which only grows from one scenario to the
+next). With several workers, the segmentation and proximity times are
+summed over the processes. From the repository root::
+
+    python benchmarks/bench_engine.py
+    python benchmarks/bench_engine.py --scenario dense --features 20000 --json out.json
+
+Only NumPy is needed. With --write, the segments are also written to a
+GeoPackage through QGIS, which must then be importable.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GeoLinesQC.engine import (
+    DEFAULT_REFERENCE_CHUNK_LENGTH,
+    INDEX_RTREE,
+    INDEXES,
+    ReferenceIndex,
+    check_lines,
+    check_lines_parallel,
+)
+from GeoLinesQC.stats import RunStats
+
+# Feature count, line length [m], vertex spacing [m] and offset noise, as a
+# fraction of the buffer distance, of the predefined scenarios
+SCENARIOS = {
+    "small": {"features": 500, "length": 5000.0, "spacing": 50.0, "noise": 0.2},
+    "dense": {"features": 2000, "length": 5000.0, "spacing": 10.0, "noise": 0.2},
+    "long": {"features": 200, "length": 50000.0, "spacing": 50.0, "noise": 0.2},
+    "noisy": {"features": 500, "length": 5000.0, "spacing": 50.0, "noise": 1.5},
+}
+
+
+def random_line(rng, start, length, spacing):
+    """
+    Generates a smooth random walk, like a digitized geological contact.
+
+    Returns:
+        ndarray: The (n, 2) vertices.
+    """
+    count = max(2, int(length / spacing) + 1)
+    angles = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.15, count - 1))
+    steps = spacing * np.column_stack((np.cos(angles), np.sin(angles)))
+    return np.vstack((start, start + np.cumsum(steps, axis=0)))
+
+
+def generate(features, length, spacing, noise, buffer_distance, seed, matched=0.7):
+    """
+    Generates a reference line set and an input line set digitized from it.
+
+    A fraction of the input lines are noisy copies of reference lines, the
+    offset noise being relative to the buffer distance; the others are
+    unrelated lines.
+
+    Returns:
+        tuple: The reference parts and the input (fid, parts) lines.
+    """
+    rng = np.random.default_rng(seed)
+    extent = math.sqrt(features) * length
+    reference = [
+        random_line(rng, rng.uniform(0, extent, 2), length, spacing)
+        for _ in range(features)
+    ]
+
+    lines = []
+    for fid in range(features):
+        if rng.random() < matched:
+            source = reference[fid]
+            offset = rng.normal(0, noise * buffer_distance, source.shape)
+            # Smooth the noise, digitizing errors are correlated along a line
+            kernel = np.ones(5) / 5
+            offset = np.column_stack(
+                [np.convolve(offset[:, axis], kernel, mode="same") for axis in (0, 1)]
+            )
+            coords = source + offset
+        else:
+            coords = random_line(rng, rng.uniform(0, extent, 2), length, spacing)
+        lines.append((fid, [coords]))
+    return reference, lines
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of the process, None if unknown."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def write_geopackage(results, path):
+    """Writes the checked segments to a GeoPackage through QGIS."""
+    from qgis.core import QgsCoordinateReferenceSystem, QgsFeature
+
+    from GeoLinesQC.analysis import add_features, open_output_file
+    from GeoLinesQC.utils import coords_to_geometry
+
+    sink, fields, output = open_output_file(
+        path, QgsCoordinateReferenceSystem("EPSG:2056"), "segments"
+    )
+    batch = []
+    for fid, coords, intersects, _distance in results:
+        feature = QgsFeature(fields)
+        feature.setGeometry(coords_to_geometry(coords))
+        feature.setAttribute("id", fid)
+        feature.setAttribute("intersects", intersects)
+        batch.append(feature)
+        if len(batch) >= 1000:
+            add_features(sink, batch)
+            batch = []
+    if batch:
+        add_features(sink, batch)
+    del sink, output
+
+
+def run_scenario(name, options):
+    """
+    Runs every stage of one scenario.
+
+    Returns:
+        dict: The parameters, stage timings [s], counts and throughput.
+    """
+    params = dict(SCENARIOS[name])
+    for key in ("features", "length", "spacing", "noise"):
+        if getattr(options, key) is not None:
+            params[key] = getattr(options, key)
+
+    reference, lines = generate(
+        params["features"],
+        params["length"],
+        params["spacing"],
+        params["noise"],
+        options.buffer,
+        options.seed,
+    )
+    stats = RunStats()
+
+    with stats.stage("index"):
+        index = ReferenceIndex(reference, options.chunk_length, options.index)
+    index.stats = stats
+
+    # Segmentation and proximity are timed separately by the engine
+    if options.workers > 1:
+        results = list(
+            check_lines_parallel(
+                lines,
+                index,
+                options.buffer,
+                options.segment_length,
+                options.workers,
+                stats=stats,
+            )
+        )
+    else:
+        results = list(
+            check_lines(
+                lines, index, options.buffer, options.segment_length, stats=stats
+            )
+        )
+
+    if options.write:
+        with tempfile.TemporaryDirectory() as directory, stats.stage("write"):
+            write_geopackage(results, os.path.join(directory, "segments.gpkg"))
+
+    data = stats.as_dict()
+    timings = data["timings"]
+    segment_count = data["counters"].get("segments", 0)
+    intersecting = sum(intersects for _fid, _coords, intersects, _d in results)
+    return {
+        "scenario": name,
+        **params,
+        "buffer": options.buffer,
+        "segment_length": options.segment_length,
+        "index": options.index,
+        "workers": options.workers,
+        "segments": segment_count,
+        "intersecting": int(intersecting),
+        "timings": timings,
+        "counters": data["counters"],
+        "segments_per_second": segment_count / timings["proximity"]
+        if timings.get("proximity")
+        else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        choices=sorted(SCENARIOS),
+        action="append",
+        help="Scenario to run, can be repeated (default: all)",
+    )
+    parser.add_argument("--features", type=int, help="Number of lines per set")
+    parser.add_argument("--length", type=float, help="Length of the lines [m]")
+    parser.add_argument("--spacing", type=float, help="Vertex spacing [m]")
+    parser.add_argument(
+        "--noise", type=float, help="Offset noise, relative to the buffer distance"
+    )
+    parser.add_argument("--buffer", type=float, default=500.0)
+    parser.add_argument("--segment-length", type=float, default=200.0)
+    parser.add_argument(
+        "--chunk-length", type=float, default=DEFAULT_REFERENCE_CHUNK_LENGTH
+    )
+    parser.add_argument("--index", choices=INDEXES, default=INDEX_RTREE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--write", action="store_true", help="Also time the GeoPackage output (QGIS)"
+    )
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    app = None
+    if options.write:
+        from GeoLinesQC.__main__ import init_qgis
+
+        app = init_qgis()
+
+    results = []
+    for name in options.scenario or list(SCENARIOS):
+        result = run_scenario(name, options)
+        results.append(result)
+        stages = ", ".join(
+            f"{stage} {seconds:.2f} s" for stage, seconds in result["timings"].items()
+        )
+        rss = result["peak_rss_mb"]
+        print(
+            f"{name:<6} {result['segments']:>8} segments "
+            f"{result['segments_per_second'] or 0:>10.0f} segments/s | {stages}"
+            + (f" | peak RSS {rss:.0f} MB" if rss is not None else "")
+        )
+
+    if app is not None:
+        app.exitQgis()
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
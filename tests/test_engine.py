@@ -0,0 +1,267 @@
+"""Checks the NumPy engine against brute force computations.
+
+Only NumPy is needed, QGIS is not imported.
+"""
+
+import struct
+
+import numpy as np
+import pytest
+
+from GeoLinesQC.engine import (
+    INDEX_RTREE,
+    INDEXES,
+    PRETEST_BLOCK_SEGMENTS,
+    GridIndex,
+    ReferenceIndex,
+    STRtree,
+    check_line,
+    parse_distance,
+    parse_distances,
+    parts_from_wkb,
+    segment_distances,
+    segment_line,
+    segment_single_line,
+)
+
+
+def random_walk(rng, count, spacing, start=(0.0, 0.0)):
+    angles = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.3, count - 1))
+    steps = spacing * np.column_stack((np.cos(angles), np.sin(angles)))
+    return np.vstack((start, start + np.cumsum(steps, axis=0)))
+
+
+def length(coords):
+    return np.hypot(*np.diff(coords, axis=0).T).sum()
+
+
+def brute_distance(coords, reference):
+    """Minimum distance between a line and reference lines, over all edge pairs."""
+    starts = np.vstack([part[:-1] for part in reference])
+    ends = np.vstack([part[1:] for part in reference])
+    return segment_distances(coords[:-1], coords[1:], starts, ends).min()
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(42)
+
+
+@pytest.mark.parametrize("segment_length", [7.0, 50.0, 200.0, 1000.0])
+def test_segment_single_line(rng, segment_length):
+    coords = random_walk(rng, 60, 10.0)
+    segments = segment_single_line(coords, segment_length)
+
+    lengths = [length(segment) for segment in segments]
+    assert sum(lengths) == pytest.approx(length(coords))
+    assert lengths[:-1] == pytest.approx([segment_length] * (len(segments) - 1))
+    assert lengths[-1] <= segment_length + 1e-9
+    np.testing.assert_array_equal(segments[0][0], coords[0])
+    np.testing.assert_array_equal(segments[-1][-1], coords[-1])
+    for previous, segment in zip(segments[:-1], segments[1:]):
+        np.testing.assert_array_equal(previous[-1], segment[0])
+
+    # Every vertex of the line is kept in a segment
+    vertices = {tuple(point) for segment in segments for point in segment}
+    assert {tuple(point) for point in coords} <= vertices
+
+
+def test_segment_single_line_cut_on_vertex():
+    coords = np.array([[0.0, 0.0], [10.0, 0.0], [20.0, 0.0], [25.0, 0.0]])
+    segments = segment_single_line(coords, 10.0)
+    assert [segment.tolist() for segment in segments] == [
+        [[0.0, 0.0], [10.0, 0.0]],
+        [[10.0, 0.0], [20.0, 0.0]],
+        [[20.0, 0.0], [25.0, 0.0]],
+    ]
+
+
+def test_segment_line_drops_empty_parts():
+    part = np.array([[0.0, 0.0], [30.0, 0.0]])
+    segments = segment_line([np.zeros((0, 2)), part], 10.0)
+    assert len(segments) == 3
+
+
+def test_segment_distances(rng):
+    a_start, a_end, b_start, b_end = rng.uniform(0, 100, (4, 40, 2))
+    distances = segment_distances(a_start, a_end, b_start, b_end)
+
+    # Densely sampled points of both segments
+    t = np.linspace(0, 1, 401)[:, None]
+    for i in range(len(a_start)):
+        a = a_start[i] + t * (a_end[i] - a_start[i])
+        for j in range(len(b_start)):
+            b = b_start[j] + t * (b_end[j] - b_start[j])
+            sampled = np.hypot(*(a[:, None] - b[None]).T).min()
+            assert distances[i, j] <= sampled + 1e-9
+            assert distances[i, j] >= sampled - 0.5
+
+
+def test_segment_distances_crossing():
+    distances = segment_distances(
+        np.array([[0.0, 0.0]]),
+        np.array([[10.0, 10.0]]),
+        np.array([[0.0, 10.0]]),
+        np.array([[10.0, 0.0]]),
+    )
+    assert distances[0, 0] == 0.0
+
+
+@pytest.mark.parametrize("index_class", [STRtree, GridIndex])
+def test_index_query(rng, index_class):
+    lower = rng.uniform(0, 1000, (500, 2))
+    bounds = np.hstack((lower, lower + rng.uniform(0, 50, (500, 2))))
+    index = STRtree(bounds) if index_class is STRtree else GridIndex(bounds, 40.0)
+
+    for _ in range(100):
+        xmin, ymin = rng.uniform(-100, 1000, 2)
+        xmax, ymax = (xmin, ymin) + rng.uniform(0, 300, 2)
+        expected = np.flatnonzero(
+            (bounds[:, 0] <= xmax)
+            & (bounds[:, 2] >= xmin)
+            & (bounds[:, 1] <= ymax)
+            & (bounds[:, 3] >= ymin)
+        )
+        found = index.query(xmin, ymin, xmax, ymax)
+        assert sorted(set(found.tolist())) == expected.tolist()
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_check_line(rng, index):
+    reference = [random_walk(rng, 20, 25.0, rng.uniform(0, 2000, 2)) for _ in range(40)]
+    reference_index = ReferenceIndex(reference, 100.0, index)
+    lines = [random_walk(rng, 80, 20.0, rng.uniform(0, 2000, 2)) for _ in range(10)]
+    # Longer than a pretest block, and following a reference line
+    lines.append(reference[0] + 30.0)
+
+    for line in lines:
+        results = check_line([line], reference_index, 50.0, 15.0)
+        segments = segment_single_line(line, 15.0)
+        assert len(results) == len(segments) > PRETEST_BLOCK_SEGMENTS
+        for (coords, intersects, distance), segment in zip(results, segments):
+            np.testing.assert_array_equal(coords, segment)
+            assert intersects == (brute_distance(segment, reference) <= 50.0)
+            assert intersects == reference_index.intersects(segment, 50.0)
+            assert distance is None
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_check_line_distances(rng, index):
+    reference = [random_walk(rng, 20, 25.0, rng.uniform(0, 1000, 2)) for _ in range(20)]
+    reference_index = ReferenceIndex(reference, 100.0, index)
+    line = random_walk(rng, 80, 20.0, rng.uniform(0, 1000, 2))
+
+    results = check_line(
+        [line], reference_index, [20.0, 50.0], 15.0, max_distance=100.0
+    )
+    for coords, intersects, distance in results:
+        expected = brute_distance(coords, reference)
+        assert intersects == (expected <= 20.0, expected <= 50.0)
+        if expected <= 100.0:
+            assert distance == pytest.approx(expected)
+        else:
+            assert distance is None
+
+
+class BufferReference:
+    """A reference with a different test per distance, like buffer polygons."""
+
+    def __init__(self, reference):
+        self.reference = reference
+
+    def intersects(self, coords, buffer_distance):
+        return self.reference.intersects(coords, buffer_distance * 0.9)
+
+    def distance(self, coords, max_distance):
+        return self.reference.distance(coords, max_distance)
+
+
+def test_check_line_thresholds_of_non_exact_reference(rng):
+    reference = [random_walk(rng, 20, 25.0, rng.uniform(0, 1000, 2)) for _ in range(20)]
+    buffer_reference = BufferReference(ReferenceIndex(reference, 100.0))
+    line = random_walk(rng, 80, 20.0, rng.uniform(0, 1000, 2))
+
+    results = check_line([line], buffer_reference, [20.0, 50.0], 15.0)
+    for threshold, position in ((20.0, 0), (50.0, 1)):
+        single = check_line([line], buffer_reference, threshold, 15.0)
+        assert [intersects[position] for _c, intersects, _d in results] == [
+            intersects for _c, intersects, _d in single
+        ]
+
+
+def test_check_line_out_of_reach():
+    # A long diagonal line, far from reference lines filling its bounding box
+    line = np.linspace([0.0, 0.0], [5000.0, 5000.0], 500)
+    reference = [
+        np.array([[x, y], [x + 100.0, y]])
+        for x in range(0, 5000, 250)
+        for y in range(0, 5000, 250)
+        if abs(x - y) > 1000
+    ]
+    reference_index = ReferenceIndex(reference, 100.0, INDEX_RTREE)
+    results = check_line([line], reference_index, 50.0, 100.0)
+    assert not any(intersects for _coords, intersects, _distance in results)
+
+
+@pytest.mark.parametrize("index", INDEXES)
+def test_save_load(rng, tmp_path, index):
+    reference = [random_walk(rng, 20, 25.0, rng.uniform(0, 1000, 2)) for _ in range(20)]
+    saved = ReferenceIndex(reference, 100.0, index)
+    saved.save(str(tmp_path))
+    loaded = ReferenceIndex.load(str(tmp_path))
+
+    assert loaded.index == index
+    assert len(loaded) == len(saved)
+    for name in ReferenceIndex.ARRAYS:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(saved, name))
+
+    line = random_walk(rng, 80, 20.0, rng.uniform(0, 1000, 2))
+    for segment in segment_single_line(line, 15.0):
+        assert loaded.intersects(segment, 50.0) == saved.intersects(segment, 50.0)
+        assert loaded.distance(segment, 100.0) == saved.distance(segment, 100.0)
+
+
+def linestring_wkb(coords):
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return struct.pack("<BII", 1, 2, len(coords)) + coords.astype("<f8").tobytes()
+
+
+def test_parts_from_wkb():
+    line = [[0.0, 0.0], [1.0, 2.0], [3.0, 4.0]]
+    (part,) = parts_from_wkb(linestring_wkb(line))
+    np.testing.assert_array_equal(part, line)
+
+    multi = struct.pack("<BII", 1, 5, 2) + linestring_wkb([]) + linestring_wkb(line)
+    parts = parts_from_wkb(multi)
+    assert len(parts) == 1
+    np.testing.assert_array_equal(parts[0], line)
+
+
+@pytest.mark.parametrize(
+    "wkb",
+    [b"", linestring_wkb([[0.0, 0.0], [1.0, 1.0]])[:-4], struct.pack("<BI", 1, 5)],
+)
+def test_parts_from_wkb_invalid(wkb):
+    with pytest.raises(ValueError, match="Invalid WKB"):
+        parts_from_wkb(wkb)
+
+
+def test_parts_from_wkb_unsupported():
+    with pytest.raises(ValueError, match="Unsupported"):
+        parts_from_wkb(struct.pack("<Bidd", 1, 1, 0.0, 0.0))
+
+
+def test_parse_distances():
+    assert parse_distances("100, 500,100, 2.5") == [100.0, 500.0, 2.5]
+    with pytest.raises(ValueError):
+        parse_distances(" , ")
+    with pytest.raises(ValueError):
+        parse_distances("100, -5")
+    with pytest.raises(ValueError):
+        parse_distances("100, nan")
+
+
+@pytest.mark.parametrize("text", ["abc", "-1", "inf", "nan"])
+def test_parse_distance_invalid(text):
+    with pytest.raises(ValueError):
+        parse_distance(text)
@@ -0,0 +1,81 @@
+"""Checks the profilers of a run and the files they write."""
+
+import json
+import pstats
+import re
+import time
+
+import pytest
+
+from GeoLinesQC.profiling import (
+    PROFILER_CPROFILE,
+    PROFILER_SAMPLING,
+    CProfiler,
+    SamplingProfiler,
+    create_profiler,
+)
+
+# "<seconds> s <share>%  <function> (<file>:<line>)"
+TOP_FUNCTION = re.compile(r"^ *\d+\.\d{3} s +\d+\.\d%  \S.* \([^:()]+:\d+\)$")
+
+
+def busy_loop(seconds):
+    total = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += sum(range(100))
+    return total
+
+
+def test_create_profiler():
+    assert isinstance(create_profiler(PROFILER_CPROFILE), CProfiler)
+    assert isinstance(create_profiler(PROFILER_SAMPLING), SamplingProfiler)
+    with pytest.raises(ValueError, match="Unknown profiler"):
+        create_profiler("perf")
+
+
+def test_cprofiler(tmp_path):
+    with CProfiler() as profiler:
+        busy_loop(0.05)
+
+    lines = profiler.top_functions(3)
+    assert 0 < len(lines) <= 3
+    for line in lines:
+        assert TOP_FUNCTION.match(line), line
+    assert any("busy_loop (test_profiling.py:" in line for line in lines)
+
+    path = profiler.save(str(tmp_path / "run"))
+    assert path.endswith(".prof")
+    functions = {name for _file, _line, name in pstats.Stats(path).stats}
+    assert "busy_loop" in functions
+
+
+def test_sampling_profiler(tmp_path):
+    with SamplingProfiler(interval=0.001) as profiler:
+        busy_loop(0.2)
+
+    path = profiler.save(str(tmp_path / "run"))
+    assert path.endswith(".speedscope.json")
+    with open(path) as f:
+        data = json.load(f)
+
+    assert data["$schema"] == "https://www.speedscope.app/file-format-schema.json"
+    frames = data["shared"]["frames"]
+    assert all(set(frame) == {"name", "file", "line"} for frame in frames)
+    assert "busy_loop" in {frame["name"] for frame in frames}
+
+    (profile,) = data["profiles"]
+    assert profile["type"] == "sampled"
+    assert profile["unit"] == "seconds"
+    assert profile["startValue"] == 0
+    assert profile["endValue"] == pytest.approx(profiler.duration)
+    assert profile["samples"]
+    assert len(profile["samples"]) == len(profile["weights"])
+    for stack in profile["samples"]:
+        assert all(0 <= frame < len(frames) for frame in stack)
+    assert all(weight > 0 for weight in profile["weights"])
+
+    lines = profiler.top_functions(3)
+    assert 0 < len(lines) <= 3
+    for line in lines:
+        assert TOP_FUNCTION.match(line), line
@@ -0,0 +1,94 @@
+"""Checks the run statistics, with a fake clock."""
+
+import pytest
+
+from GeoLinesQC import stats as stats_module
+from GeoLinesQC.stats import STAGES, RunStats
+
+
+class Clock:
+    """Replaces time.perf_counter, advanced by hand."""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def perf_counter(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stats_module, "time", clock)
+    return clock
+
+
+def test_timed(clock):
+    stats = RunStats()
+
+    def produce():
+        for item in "abc":
+            clock.advance(1.0)
+            yield item
+        clock.advance(0.5)
+
+    items = []
+    for item in stats.timed(produce(), "load"):
+        # Time spent by the consumer is not counted
+        clock.advance(10.0)
+        items.append(item)
+
+    assert items == ["a", "b", "c"]
+    assert stats.timings == {"load": pytest.approx(3.5)}
+
+
+def test_stage(clock):
+    stats = RunStats()
+    with pytest.raises(RuntimeError), stats.stage("index"):
+        clock.advance(2.0)
+        raise RuntimeError
+    with stats.stage("index"):
+        clock.advance(1.0)
+    assert stats.timings == {"index": pytest.approx(3.0)}
+
+
+def test_merge(clock):
+    stats = RunStats()
+    stats.add_time("proximity", 1.0)
+    stats.count("segments", 10)
+
+    worker = RunStats()
+    worker.add_time("proximity", 2.0)
+    worker.add_time("segmentation", 0.5)
+    worker.count("segments", 5)
+    worker.count("candidates", 7)
+    stats.merge(worker.as_dict())
+
+    assert stats.timings == {"proximity": 3.0, "segmentation": 0.5}
+    assert stats.counters == {"segments": 15, "candidates": 7}
+
+
+def test_as_dict_stage_order(clock):
+    stats = RunStats()
+    for stage in ("custom", *reversed(STAGES)):
+        stats.add_time(stage, 1.0)
+    clock.advance(4.0)
+
+    data = stats.as_dict()
+    assert list(data["timings"]) == [*STAGES, "custom"]
+    assert data["elapsed"] == pytest.approx(4.0)
+    assert data["counters"] == {}
+
+
+def test_summary(clock):
+    stats = RunStats()
+    stats.add_time("proximity", 1.25)
+    stats.add_time("index", 0.5)
+    stats.count("segments", 3)
+    clock.advance(2.0)
+    assert stats.summary() == (
+        "index 0.50 s, proximity 1.25 s (elapsed 2.00 s) | segments 3"
+    )